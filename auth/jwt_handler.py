@@ -23,37 +23,86 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from database import db
 from bson import ObjectId
+from services.cache import TTLCache
+from pydantic import BaseModel
+from typing import Optional
+import copy
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 SECRET_KEY = "your-super-secret-key"
 ALGORITHM = "HS256"
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+ROLE_COLLECTIONS = {
+    "user": "app_user",
+    "chef": "chef_user",
+    "delivery": "delivery_user",
+}
+
+# Per-process cache of authenticated user documents, keyed by (role, sub)
+principal_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+def invalidate_principal(role: str, user_id):
+    """Drop a cached user document after its profile has been changed."""
+    principal_cache.invalidate((role, str(user_id)))
+
+
+class Principal(BaseModel):
+    """Caller identity built only from verified JWT claims."""
+    id: str
+    role: str
+    phone_number: Optional[str] = None
+
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        role = payload.get("role")
-
-        if not user_id or not role:
-            raise HTTPException(status_code=401, detail="Invalid token")
-
-        # pick correct collection
-        if role == "user":
-            collection = "app_user"
-        elif role == "chef":
-            collection = "chef_user"
-        elif role == "delivery":
-            collection = "delivery_user"
-        else:
-            raise HTTPException(status_code=401, detail="Unknown role")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user_id = payload.get("sub")
+    role = payload.get("role")
 
+    if not user_id or not role or not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if role not in ROLE_COLLECTIONS:
+        raise HTTPException(status_code=401, detail="Unknown role")
+
+    return payload
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Lightweight auth dependency for endpoints that only need the caller's id and role.
+
+    No database round trip is made, so use get_current_user when the full
+    profile document is required.
+    """
+    payload = decode_token(token)
+    return Principal(
+        id=payload["sub"],
+        role=payload["role"],
+        phone_number=payload.get("phone_number"),
+    )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    user_id = payload["sub"]
+    role = payload["role"]
+
+    # pick correct collection
+    collection = ROLE_COLLECTIONS[role]
+
+    cache_key = (role, str(user_id))
+    user = principal_cache.get(cache_key)
+    if user is None:
         user = await db[collection].find_one({"_id": ObjectId(user_id)})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         user["role"] = role  # attach role to response
-        return user
+        principal_cache.set(cache_key, user)
 
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    # routes mutate the returned dict, so never hand out the cached one
+    return copy.deepcopy(user)
@@ -0,0 +1,50 @@
+# benchmarks/bench_distance.py
+# Scalar haversine loop vs. the NumPy batch distance module.
+# Run from the repo root: python -m benchmarks.bench_distance
+import random
+import time
+
+import numpy as np
+
+from services.distance import distance_matrix, distances_from, haversine
+
+SIZES = [10, 1_000, 100_000]
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    rnd = random.Random(7)
+    origin = [78.4867, 17.3850]
+
+    # "list" passes Python lists as the routers do; "array" passes a prebuilt ndarray
+    print(f"{'points':>8} {'loop ms':>10} {'list ms':>10} {'array ms':>10} {'speedup':>8}")
+    for n in SIZES:
+        points = [[78 + rnd.random(), 17 + rnd.random()] for _ in range(n)]
+        repeat = 5 if n >= 100_000 else 50
+
+        loop_ms = _best_of(lambda: [haversine(origin[0], origin[1], lon, lat) for lon, lat in points], repeat)
+        numpy_ms = _best_of(lambda: distances_from(origin, points), repeat)
+        array = np.asarray(points)
+        array_ms = _best_of(lambda: distances_from(origin, array), repeat)
+        print(f"{n:>8} {loop_ms:>10.3f} {numpy_ms:>10.3f} {array_ms:>10.3f} {loop_ms / numpy_ms:>7.1f}x")
+
+    # origin x destination matrix, e.g. 50 ready orders x 1k partners
+    origins = [[78 + rnd.random(), 17 + rnd.random()] for _ in range(50)]
+    destinations = [[78 + rnd.random(), 17 + rnd.random()] for _ in range(1_000)]
+    loop_ms = _best_of(
+        lambda: [[haversine(o[0], o[1], d[0], d[1]) for d in destinations] for o in origins], 5
+    )
+    numpy_ms = _best_of(lambda: distance_matrix(origins, destinations), 5)
+    print(f"matrix 50x1000: loop {loop_ms:.3f}ms, numpy {numpy_ms:.3f}ms ({loop_ms / numpy_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
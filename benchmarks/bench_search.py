@@ -0,0 +1,58 @@
+# benchmarks/bench_search.py
+# Typeahead latency of the in-process search index on a synthetic catalog.
+# Run from the repo root: python -m benchmarks.bench_search
+import random
+import time
+
+from services.search import SearchIndex
+
+WORDS = [
+    "chicken", "chapati", "chettinad", "biryani", "paneer", "masala", "dosa", "idli", "sambar",
+    "rasam", "curry", "fry", "tikka", "butter", "dal", "roti", "naan", "pulao", "kheer", "halwa",
+    "mutton", "fish", "prawn", "egg", "veg", "aloo", "gobi", "palak", "korma", "kebab",
+]
+STYLES = ["Andhra Style", "Kerala Style", "Punjabi Style", "Goa Style", "Tamilian Style"]
+QUERIES = ["c", "ch", "chi", "chicken", "chicken bir", "andhra ch", "v", "lunch", "paneer tik"]
+
+
+def build(n_items: int = 100_000, n_chefs: int = 2_000) -> SearchIndex:
+    rnd = random.Random(42)
+    vocab = WORDS + [f"dish{i}" for i in range(3_000)]
+    index = SearchIndex()
+    for c in range(n_chefs):
+        index.index_chef({
+            "_id": f"chef{c}",
+            "name": f"chef {rnd.choice(vocab)}",
+            "food_styles": [rnd.choice(STYLES)],
+            "location": {"type": "Point", "coordinates": [78 + rnd.random(), 17 + rnd.random()]},
+            "rating": rnd.random() * 5,
+        })
+    for i in range(n_items):
+        index.index_item({
+            "_id": f"item{i}",
+            "chef_id": f"chef{rnd.randrange(n_chefs)}",
+            "food_name": " ".join(rnd.choices(WORDS, k=2) + [rnd.choice(vocab)]),
+            "food_style": rnd.choice(STYLES),
+            "food_type": rnd.choice(["Veg", "Non Veg"]),
+            "service_type": rnd.choice(["Breakfast", "Lunch", "Dinner"]),
+        })
+    return index
+
+
+def main():
+    start = time.perf_counter()
+    index = build()
+    print(f"indexed {len(index)} documents in {time.perf_counter() - start:.2f}s")
+
+    for query in QUERIES:
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            index.search(query, limit=10, origin=[78.5, 17.5])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{query!r:16} p50={timings[10]:.2f}ms  max={timings[-1]:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# benchmarks/bench_serialization.py
+# Encoding time of a 500-order listing response: the old per-router ObjectId
+# walker + FastAPI's jsonable_encoder + json.dumps, against one orjson pass.
+# Run from the repo root: python -m benchmarks.bench_serialization
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from services.serialization import dumps
+
+DISHES = ["Chicken Biryani", "Paneer Tikka", "Masala Dosa", "Idli Sambar", "Butter Naan", "Fish Curry"]
+STATUSES = ["pending", "accepted", "preparing", "picked", "delivered"]
+
+
+def make_orders(n: int = 500) -> list:
+    rnd = random.Random(42)
+    now = datetime.utcnow()
+    orders = []
+    for _ in range(n):
+        chef_id = str(ObjectId())
+        items = [{
+            "food_id": str(ObjectId()),
+            "chef_id": chef_id,
+            "food_name": rnd.choice(DISHES),
+            "price": round(rnd.uniform(60, 400), 2),
+            "quantity": rnd.randint(1, 4),
+            "photo_url": f"/static/media/{rnd.getrandbits(256):064x}.jpg",
+        } for _ in range(rnd.randint(1, 5))]
+        orders.append({
+            "_id": ObjectId(),
+            "user_id": str(ObjectId()),
+            "chef_id": chef_id,
+            "delivery_boy_id": str(ObjectId()),
+            "items": items,
+            "total_price": sum(i["price"] * i["quantity"] for i in items),
+            "address": {
+                "_id": ObjectId(), "label": "Home", "line1": "12-3-45, Road No. 7", "city": "Hyderabad",
+                "location": {"type": "Point", "coordinates": [78 + rnd.random(), 17 + rnd.random()]},
+            },
+            "status": rnd.choice(STATUSES),
+            "chef_status": rnd.choice(STATUSES),
+            "delivery_status": rnd.choice(STATUSES),
+            "created_at": now - timedelta(minutes=rnd.randint(0, 60 * 24 * 30)),
+            "chef_summary": {"name": "Chef Lakshmi", "phone": "9876543210", "profile_pic": None,
+                             "location": {"type": "Point", "coordinates": [78.45, 17.41]}},
+            "customer_summary": {"name": "Ravi", "phone": "9123456780", "email": "ravi@example.com",
+                                 "photo_url": None, "location": None},
+        })
+    return orders
+
+
+def convert_object_ids(data):
+    """The recursive walker routers/chef.py used before every response."""
+    if isinstance(data, list):
+        return [convert_object_ids(i) for i in data]
+    elif isinstance(data, dict):
+        return {k: str(v) if isinstance(v, ObjectId) else convert_object_ids(v) for k, v in data.items()}
+    return data
+
+
+def legacy(payload) -> bytes:
+    # walker, then FastAPI's encoder, then Starlette's JSONResponse.render
+    content = jsonable_encoder(convert_object_ids(payload))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def timeit(fn, payload, rounds: int = 50) -> list:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(payload)
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)
+
+
+def main():
+    payload = {"status": "success", "orders": make_orders(), "next_cursor": None}
+    assert json.loads(legacy(payload)) == json.loads(dumps(payload))
+    print(f"payload: 500 orders, {len(dumps(payload)) / 1024:.0f} KB of JSON")
+
+    for name, fn in [("walker + jsonable_encoder + json", legacy), ("orjson single pass", dumps)]:
+        timings = timeit(fn, payload)
+        print(f"{name:34} p50={timings[len(timings) // 2]:.2f}ms  max={timings[-1]:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,40 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 # Routers
 from routers.user import router as user_router
 from routers.chef import router as chef_router
 from routers.foodstyle import router as food_style_router
 from routers.delivery import router as delivery
+from routers.media import router as media_router
 from mongoengine import connect
+from auth.jwt_handler import principal_cache
+from services.items import item_cache
+from services.indexes import ensure_indexes, run_index_diagnostics
+from services.facets import backfill_facet_keys
+from services.ratings import backfill_rating_summaries
+from services.order_summary import backfill_order_summaries
+from services.search import refresh_search_index_forever
+from services.dispatch import dispatch_stats
+from services.broker import broker
+from services.order_events import order_events
+from services.locations import flush_locations, flush_locations_forever, location_stats
+from services.checkout import checkout_stats
+from services.images import image_stats, shutdown_image_pool
+from services.media import collect_media_forever, media_stats
+from services.media_serving import media_serving_stats
+from services.serialization import MongoJSONResponse, MongoJSONRoute
+from services.uploads import UploadLimitMiddleware
+import asyncio
 
-app = FastAPI()
-# Mount "uploads" folder
+# Responses are encoded by orjson in one pass, ObjectId and datetime included
+app = FastAPI(default_response_class=MongoJSONResponse)
+app.router.route_class = MongoJSONRoute
 import os
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "uploads")), name="static")
-app.mount("/static/chefprofile", StaticFiles(directory=os.path.join(BASE_DIR, "uploads/profile")), name="chefprofile")
 connect(db="maakitchen", host="mongodb://3.110.207.229:27017")
+# Oversized uploads are refused while the body is arriving, not after it is spooled.
+# Added before CORS so that CORS wraps it and its 413 reaches browsers with CORS headers.
+app.add_middleware(UploadLimitMiddleware)
 # Allow CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -25,13 +44,99 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Make sure the indexes the routers depend on exist.
+# Set INDEX_DIAGNOSTICS=1 to also explain the canonical queries and flag collection scans.
+@app.on_event("startup")
+async def bootstrap_indexes():
+    await ensure_indexes()
+    await backfill_facet_keys()
+    await backfill_rating_summaries()
+    await backfill_order_summaries()
+    if os.getenv("INDEX_DIAGNOSTICS") == "1":
+        await run_index_diagnostics()
+
+
+# Load the in-process search index in the background, then keep it fresh
+@app.on_event("startup")
+async def start_search_index():
+    asyncio.create_task(refresh_search_index_forever())
+
+# Route partner messages between workers (CONNECTION_BROKER=mongo)
+@app.on_event("startup")
+async def start_connection_broker():
+    await broker.start()
+
+# Rider positions streamed over the websocket are written in periodic batches
+@app.on_event("startup")
+async def start_location_flusher():
+    asyncio.create_task(flush_locations_forever())
+
+# Unreferenced uploads are swept from the media store periodically
+@app.on_event("startup")
+async def start_media_gc():
+    asyncio.create_task(collect_media_forever())
+
+
+@app.on_event("shutdown")
+async def flush_pending_locations():
+    await flush_locations()
+
+
+@app.on_event("shutdown")
+def stop_image_workers():
+    shutdown_image_pool()
+
 # Route registration
 app.include_router(user_router, prefix="/api")
 app.include_router(delivery, prefix="/api")
 app.include_router(chef_router, prefix="/api")
 app.include_router(food_style_router, prefix="/api")
+# Uploaded files at /static/... with ETag, range and long-lived cache headers
+app.include_router(media_router)
 
 # Health check (optional)
 @app.get("/")
 def read_root():
     return {"message": "API is up and running"}
+
+
+# Cache hit/miss counters
+@app.get("/stats/cache")
+def cache_stats():
+    return {"principal_cache": principal_cache.stats(), "item_cache": item_cache.stats(), **media_serving_stats()}
+
+
+# Dispatch counters and time-to-assignment
+@app.get("/stats/dispatch")
+def get_dispatch_stats():
+    return dispatch_stats()
+
+
+# Order event streams and fan-out counters
+@app.get("/stats/events")
+def get_event_stats():
+    return order_events.stats()
+
+
+# Rider location frames, pushes and batched writes
+@app.get("/stats/locations")
+def get_location_stats():
+    return location_stats()
+
+
+# Checkout outcomes and per-step latency (p50/p99)
+@app.get("/stats/checkout")
+def get_checkout_stats():
+    return checkout_stats()
+
+
+# Background image variant jobs
+@app.get("/stats/images")
+def get_image_stats():
+    return image_stats()
+
+
+# Content-addressed media store: dedup hits and GC sweeps
+@app.get("/stats/media")
+def get_media_stats():
+    return media_stats()
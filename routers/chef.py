@@ -1,6 +1,5 @@
 # routers/chef.py
-from fastapi import APIRouter, HTTPException,Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException,Depends, Query, Request
 from datetime import datetime
 from bson import ObjectId
 from typing import List, Optional
@@ -8,16 +7,23 @@ from models.chef import ChefCreate
 from database import db
 from models.chef import ChefLoginRequest,ChefPhoneCreate,LocationUpdate
 from auth.utils import create_access_token
-from auth.jwt_handler import get_current_user
+from auth.jwt_handler import get_current_user, get_current_principal, invalidate_principal, Principal
 from enum import Enum
-
-router = APIRouter()
+from services.pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.facets import facet_fields
+from services.search import search_index
+from services.order_events import publish_order_event
+from services.items import invalidate_item
+from services.media_serving import serve_file
+from services.media import store_upload, update_media_refs, release_media_refs, media_projection, MEDIA_FOLDER, MEDIA_URL_PREFIX
+from services.images import process_photo_later
+from services.serialization import MongoJSONRoute
+from services.order_summary import refresh_order_summaries_later, summarize, LISTING_EXCLUDE
+
+router = APIRouter(route_class=MongoJSONRoute)
 
 @router.get("/chefme")
 async def get_my_profile(current_user: dict = Depends(get_current_user)):
-    # Convert ObjectId to string for JSON serialization
-    current_user["_id"] = str(current_user["_id"])
-    
     return current_user
 
 @router.post("/chefs")
@@ -123,19 +129,24 @@ async def update_chef_location(
 ):
     chef_id = current_user.get("_id")
     
+    update_data = {
+        "location": {
+            "type": "Point",
+            "coordinates": [location.longitude, location.latitude],
+            "address": location.address
+        }
+    }
     result = await db["chef_user"].update_one(
         {"_id": ObjectId(chef_id)},
-        {"$set": {
-            "location": {
-                "type": "Point",
-                "coordinates": [location.longitude, location.latitude],
-                "address": location.address
-            }
-        }}
+        {"$set": update_data}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Chef not found")
+
+    invalidate_principal("chef", chef_id)
+    refresh_order_summaries_later("chef", chef_id, update_data)
+    search_index.update_chef_location(chef_id, [location.longitude, location.latitude])
     
     return {"status": "success", "message": "Location updated"}
 
@@ -153,33 +164,16 @@ async def update_chef_location(
 
 
 from fastapi import APIRouter, UploadFile, File, Form, Depends
-import os
-import uuid
 
 UPLOAD_FOLDER = "uploads/chefprofile"  # folder for chef profile images
 
-def save_image_and_get_url(contents: bytes, filename: str = None) -> str:
-    # Make sure folder exists
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-    # Create unique filename
-    ext = filename.split(".")[-1] if filename else "jpg"
-    unique_name = f"{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(UPLOAD_FOLDER, unique_name)
-
-    # Save file
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    # Return URL relative to static mount
-    return f"/static/chefprofile/{unique_name}"
+async def save_image_and_get_url(upload: UploadFile) -> str:
+    # Content-addressed: same bytes, same immutable URL (services/media.py)
+    return await store_upload(upload)
 
 @router.get("/chef/profile/image/{filename}")
-async def get_profile_image(filename: str):
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    if not os.path.exists(file_path):
-        return {"error": "Image not found"}
-    return FileResponse(file_path)
+async def get_profile_image(filename: str, request: Request):
+    return await serve_file(request, UPLOAD_FOLDER, filename)
 
 
 
@@ -209,15 +203,22 @@ async def update_chef_profile(
     if food_styles:
         update_data["food_styles"] = food_styles
     if file is not None:  # only if file uploaded
-        contents = await file.read()
-        photo_url = save_image_and_get_url(contents, file.filename)
+        photo_url = await save_image_and_get_url(file)
         update_data["photo_url"] = photo_url
+        update_data["photo_variants"] = None  # rebuilt in the background
 
     if update_data:
-        await db["chef_user"].update_one(
+        before = await db["chef_user"].find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=media_projection("chef_user")
         )
+        await update_media_refs("chef_user", before, update_data)
+        invalidate_principal("chef", user_id)
+        search_index.index_chef({**current_user, **update_data})
+        refresh_order_summaries_later("chef", user_id, update_data)
+        if file is not None:
+            process_photo_later("chef_user", ObjectId(user_id), update_data["photo_url"], MEDIA_FOLDER, MEDIA_URL_PREFIX)
 
     return {"message": "Profile updated successfully", "updated": update_data}
 
@@ -279,8 +280,7 @@ async def add_food_item(
 ):
     chef_id = current_user["_id"]
 
-    contents = await photo.read()
-    photo_url = save_image_and_get_url(contents, photo.filename)
+    photo_url = await save_image_and_get_url(photo)
 
     food_item = {
         "chef_id": ObjectId(chef_id),
@@ -291,10 +291,16 @@ async def add_food_item(
         "price": price,
         "off": off,
         "photo_url": photo_url,
-        "service_type": service_type.value
+        "service_type": service_type.value,
+        "rating": current_user.get("rating"),  # chef rating, kept in sync by add_review
+        **facet_fields(food_style.value, service_type.value, food_type)
     }
 
     result = await db["food_items"].insert_one(food_item)
+    await update_media_refs("food_items", None, food_item)
+    search_index.index_item(food_item)  # insert_one sets food_item["_id"]
+    invalidate_item(result.inserted_id)
+    process_photo_later("food_items", result.inserted_id, photo_url, MEDIA_FOLDER, MEDIA_URL_PREFIX)
 
     return {"message": "Food item added", "item_id": str(result.inserted_id)}
 
@@ -323,18 +329,25 @@ async def update_food_item(
         "quantity": quantity,
         "price": price,
         "off": off,
-        "service_type": service_type
+        "service_type": service_type,
+        **facet_fields(food_style, service_type, food_type)
     }
 
     if photo:
-        contents = await photo.read()
-        photo_url = save_image_and_get_url(contents, photo.filename)
+        photo_url = await save_image_and_get_url(photo)
         update_data["photo_url"] = photo_url
+        update_data["photo_variants"] = None  # rebuilt in the background
 
-    await db["food_items"].update_one(
+    before = await db["food_items"].find_one_and_update(
         {"_id": ObjectId(item_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection=media_projection("food_items")
     )
+    await update_media_refs("food_items", before, update_data)
+    search_index.index_item({**food_item, **update_data})
+    invalidate_item(item_id)
+    if photo:
+        process_photo_later("food_items", ObjectId(item_id), update_data["photo_url"], MEDIA_FOLDER, MEDIA_URL_PREFIX)
 
     return {"message": "Item updated successfully"}
 
@@ -349,14 +362,20 @@ async def delete_food_item(item_id: str, current_user: dict = Depends(get_curren
         raise HTTPException(status_code=404, detail="Food item not found")
 
     # Delete the item
-    await db["food_items"].delete_one({"_id": ObjectId(item_id), "chef_id": ObjectId(chef_id)})
+    deleted = await db["food_items"].find_one_and_delete(
+        {"_id": ObjectId(item_id), "chef_id": ObjectId(chef_id)},
+        projection=media_projection("food_items")
+    )
+    await release_media_refs("food_items", deleted)
+    search_index.remove_item(item_id)
+    invalidate_item(item_id)
 
     return {"message": "Food item deleted successfully", "item_id": item_id}
 
 #-----------------------------------My food items---------------------------#
 @router.get("/chef/items")
-async def get_my_food_items(current_user: dict = Depends(get_current_user)):
-    chef_id = current_user["_id"]
+async def get_my_food_items(current_user: Principal = Depends(get_current_principal)):
+    chef_id = current_user.id
 
     items_cursor = db["food_items"].find({"chef_id": ObjectId(chef_id)})
     items = []
@@ -379,116 +398,96 @@ async def get_my_food_items(current_user: dict = Depends(get_current_user)):
 
 
 
-def convert_object_ids(data):
-    """Recursively convert all ObjectId fields to strings."""
-    if isinstance(data, list):
-        return [convert_object_ids(i) for i in data]
-    elif isinstance(data, dict):
-        new_data = {}
-        for k, v in data.items():
-            if isinstance(v, ObjectId):
-                new_data[k] = str(v)
-            else:
-                new_data[k] = convert_object_ids(v)
-        return new_data
-    else:
-        return data
-
-
 @router.get("/chef/orders/incoming")
-async def get_incoming_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "chef":
+async def get_incoming_orders(current_user: Principal = Depends(get_current_principal)):
+    if current_user.role != "chef":
         raise HTTPException(status_code=403, detail="Only chefs can view orders")
 
-    chef_id = str(current_user["_id"])
+    chef_id = current_user.id
 
-    # Fetch orders for this chef
+    # Fetch orders for this chef; customer details are snapshotted on the order
     orders = await db["orders"].find(
-        {"chef_id": chef_id, "status": {"$in": ["new", "pending"]}}
+        {"chef_id": chef_id, "status": {"$in": ["new", "pending"]}},
+        {**LISTING_EXCLUDE, "chef_summary": 0, "rider_summary": 0}
     ).to_list(length=None)
 
     enriched_orders = []
     for order in orders:
-        user_id = order.get("user_id")
-        user_details = None
-
-        # Fetch user details if exists
-        if user_id:
-            user_details = await db["app_user"].find_one(
-                {"_id": ObjectId(user_id)},
-                {
-                    "_id": 0,  # exclude id to avoid redundancy
-                    "name": 1,
-                    "email": 1,
-                    "phone_number": 1,
-                    "photo_url": 1,
-                    # "address": 1
-                },
-            )
-
-        # Add user details to order
-        order["user_details"] = user_details or {}
+        user = order.pop("customer_summary", None) or {}
+        details = {
+            "name": user.get("name"),
+            "email": user.get("email"),
+            "phone_number": user.get("phone"),
+            "photo_url": user.get("photo_url"),
+        }
+        # fields the customer's profile lacks are left out, as before the snapshot
+        order["user_details"] = {k: v for k, v in details.items() if v is not None}
 
         enriched_orders.append(order)
 
-    return {"status": "success", "orders": convert_object_ids(enriched_orders)}
+    return {"status": "success", "orders": enriched_orders}
 
 
 @router.get("/chef/orders/ongoing")
-async def get_ongoing_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "chef":
+async def get_ongoing_orders(current_user: Principal = Depends(get_current_principal)):
+    if current_user.role != "chef":
         raise HTTPException(status_code=403, detail="Only chefs can view orders")
 
-    chef_id = str(current_user["_id"])
+    chef_id = current_user.id
     
-    # Fetch ongoing orders
-    orders = await db["orders"].find({
-        "chef_id": chef_id,
-        "status": {"$in": ["chef_accepted", "preparing", "ready"]}
-    }).to_list(length=None)
+    # Fetch ongoing orders; customer and rider details are snapshotted on the order
+    orders = await db["orders"].find(
+        {"chef_id": chef_id, "status": {"$in": ["chef_accepted", "preparing", "ready"]}},
+        {**LISTING_EXCLUDE, "chef_summary": 0}
+    ).to_list(length=None)
 
-    # Fetch user details for each order
     for order in orders:
-        user_id = order.get("user_id")
-        delivery=order.get("delivery_boy_id")
-        if user_id:
-            user = await db["app_user"].find_one({"_id": ObjectId(user_id)})
-            if user:
-                order["user_details"] = {
-                    "phone_number": user.get("phone_number"),
-                    "role": user.get("role"),
-                    "is_online": user.get("is_online"),
-                    "last_seen": user.get("last_seen"),
-                    "created_at": user.get("created_at"),
-                    "location": user.get("location")
-                }
-        if delivery:
-            delivery = await db["delivery_user"].find_one({"_id": ObjectId(delivery)})
-            if delivery:
-                order["delivery_user"] = {
-                    "phone_number": delivery.get("phone_number"),
-                
-                }
-
-    return {"status": "success", "orders": convert_object_ids(orders)}
+        user = order.pop("customer_summary", None)
+        rider = order.pop("rider_summary", None)
+        # unknown customers are backfilled with an all-empty summary
+        if user and any(v is not None for v in user.values()):
+            order["user_details"] = {
+                "phone_number": user.get("phone"),
+                "role": user.get("role"),
+                "is_online": user.get("is_online"),
+                "last_seen": user.get("last_seen"),
+                "created_at": user.get("created_at"),
+                "location": user.get("location")
+            }
+        if rider:
+            order["delivery_user"] = {
+                "phone_number": rider.get("phone"),
+            }
+
+    return {"status": "success", "orders": orders}
 
 
 @router.get("/chef/orders/completed")
-async def get_completed_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "chef":
+async def get_completed_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.role != "chef":
         raise HTTPException(status_code=403, detail="Only chefs can view orders")
-    chef_id = str(current_user["_id"])
-    orders = await db["orders"].find({"chef_id": chef_id, "status": {"$in": ["completed", "delivered"]}}).to_list(length=None)
-    return {"status": "success", "orders": convert_object_ids(orders)}
+    chef_id = current_user.id
+    orders, next_cursor = await paginate(
+        db["orders"], {"chef_id": chef_id, "status": {"$in": ["completed", "delivered"]}}, cursor, limit
+    )
+    return {"status": "success", "orders": orders, "next_cursor": next_cursor}
 
 
 @router.get("/chef/orders/all")
-async def get_all_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "chef":
+async def get_all_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.role != "chef":
         raise HTTPException(status_code=403, detail="Only chefs can view orders")
-    chef_id = str(current_user["_id"])
-    orders = await db["orders"].find({"chef_id": chef_id}).to_list(length=None)
-    return {"status": "success", "orders": convert_object_ids(orders)}
+    chef_id = current_user.id
+    orders, next_cursor = await paginate(db["orders"], {"chef_id": chef_id}, cursor, limit)
+    return {"status": "success", "orders": orders, "next_cursor": next_cursor}
 
 
 #update status-------------------------------#
@@ -570,18 +569,20 @@ async def update_order_status(
             update_data["delivery_status"] = "pending_assignment"
     
     try:
-        # Update the order
+        # Update the order (re-snapshot the chef's card while we have the profile)
         result = await db["orders"].update_one(
             {"_id": ObjectId(order_id)},
-            {"$set": update_data}
+            {"$set": {**update_data, "chef_summary": summarize("chef", current_user)}}
         )
         
         if result.modified_count == 0:
             raise HTTPException(status_code=400, detail="Failed to update order status")
+
+        # Push the status delta to the user, chef and rider following this order
+        await publish_order_event(order, update_data)
         
         # Fetch updated order
         updated_order = await db["orders"].find_one({"_id": ObjectId(order_id)})
-        updated_order["_id"] = str(updated_order["_id"])
         
         # Optional: Send notification to user (implement as needed)
         # await notify_user_status_update(order["user_id"], order_id, new_status)
@@ -603,9 +604,9 @@ async def update_order_status(
 
 #--------------------individual order-------------------------#
 @router.get("/orders/chef/{order_id}")
-async def get_chef_order(order_id: str, current_user: dict = Depends(get_current_user)):
+async def get_chef_order(order_id: str, current_user: Principal = Depends(get_current_principal)):
     """Get a specific order received by the chef."""
-    if current_user["role"] != "chef":
+    if current_user.role != "chef":
         raise HTTPException(status_code=403, detail="Only chefs can view this")
 
     try:
@@ -613,12 +614,8 @@ async def get_chef_order(order_id: str, current_user: dict = Depends(get_current
     except:
         raise HTTPException(status_code=400, detail="Invalid order ID")
 
-    order = await db["orders"].find_one({"_id": oid, "chef_id": str(current_user["_id"])})
+    order = await db["orders"].find_one({"_id": oid, "chef_id": current_user.id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order["_id"] = str(order["_id"])
-    if "address" in order and "_id" in order["address"]:
-        order["address"]["_id"] = str(order["address"]["_id"])
-
     return {"status": "success", "order": order}
@@ -1,7 +1,7 @@
 # routers/user.py
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile,Form, File, Body
 from bson import ObjectId
-from auth.jwt_handler import get_current_user
+from auth.jwt_handler import get_current_user, get_current_principal, invalidate_principal, Principal
 from models.user import FoodFilter   # adjust path to your actual file
 from database import get_db
 from models.user import UserCreate
@@ -10,11 +10,21 @@ from models.delivery import LocationUpdate,deliveryPhoneCreate
 from auth.utils import create_access_token  # ✅ Import token creator
 from datetime import datetime
 from typing import List, Optional
+from services.enrichment import fetch_related
+from services.pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.partners import partner_index
+from services.order_events import publish_order_event
+from services.locations import rider_orders
+from services.uploads import IMAGE_TYPES, DOCUMENT_TYPES
+from services.media import store_upload, update_media_refs, media_projection, MEDIA_FOLDER, MEDIA_URL_PREFIX
+from services.images import process_photo_later
+from services.order_summary import refresh_order_summaries_later, LISTING_EXCLUDE
+from services.serialization import MongoJSONRoute
+import asyncio
 import os
-import uuid
 
-router = APIRouter()
-# ------------------- Upload Directories -------------------
+router = APIRouter(route_class=MongoJSONRoute)
+# ------------------- Legacy Upload Directories (new uploads go to services/media.py) -------------------
 UPLOAD_DIR_PROFILE = "uploads/profile"
 UPLOAD_DIR_LICENSE = "uploads/licenses"
 
@@ -23,9 +33,6 @@ os.makedirs(UPLOAD_DIR_LICENSE, exist_ok=True)
 
 @router.get("/deliveryme")
 async def get_my_profile(current_user: dict = Depends(get_current_user)):
-    # Convert ObjectId to string for JSON serialization
-    current_user["_id"] = str(current_user["_id"])
-    
     return current_user
 
 ## ------------------- Create or Get Delivery User -------------------
@@ -85,6 +92,9 @@ async def update_location(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Delivery user not found")
 
+    invalidate_principal("delivery", str(delivery_id))
+    partner_index.update_location(str(delivery_id), location.longitude, location.latitude)
+
     return {"status": "success", "message": "Location updated"}
 
 
@@ -112,28 +122,32 @@ async def update_delivery_profile(
 
     # Profile photo
     if file is not None:
-        contents = await file.read()
-        photo_url = save_image_and_get_url(contents, file.filename)
+        photo_url = await save_image_and_get_url(file)
         update_data["photo_url"] = photo_url
+        update_data["photo_variants"] = None  # rebuilt in the background
 
     # Driving license front
     if driving_license_front is not None:
-        contents = await driving_license_front.read()
-        front_url = save_image_and_get_url(contents, driving_license_front.filename)
+        front_url = await save_image_and_get_url(driving_license_front, allowed=DOCUMENT_TYPES)
         update_data["driving_license_front"] = front_url
 
     # Driving license back
     if driving_license_back is not None:
-        contents = await driving_license_back.read()
-        back_url = save_image_and_get_url(contents, driving_license_back.filename)
+        back_url = await save_image_and_get_url(driving_license_back, allowed=DOCUMENT_TYPES)
         update_data["driving_license_back"] = back_url
 
     # Save updates if any
     if update_data:
-        await db["delivery_user"].update_one(
+        before = await db["delivery_user"].find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=media_projection("delivery_user")
         )
+        await update_media_refs("delivery_user", before, update_data)
+        invalidate_principal("delivery", user_id)
+        refresh_order_summaries_later("delivery", user_id, update_data)
+        if file is not None:
+            process_photo_later("delivery_user", ObjectId(user_id), update_data["photo_url"], MEDIA_FOLDER, MEDIA_URL_PREFIX)
 
     return {
         "message": "Profile updated successfully",
@@ -143,18 +157,19 @@ async def update_delivery_profile(
 
 #---------------------delivery ongoing ordeers------------#
 @router.get("/ongoing/delivery/me")
-async def get_my_orders(current_user: dict = Depends(get_current_user)):
+async def get_my_orders(current_user: Principal = Depends(get_current_principal)):
     # Only delivery users can access
-    if current_user.get("role") != "delivery":
+    if current_user.role != "delivery":
         raise HTTPException(status_code=403, detail="Only delivery users can access")
 
-    delivery_id = str(current_user["_id"])
+    delivery_id = current_user.id
 
-    # Fetch orders assigned to this delivery boy with pending or picked status
-    orders_cursor = db["orders"].find({
-        "delivery_boy_id": delivery_id,
-        "delivery_status": {"$in": ["assigned", "picked"]}
-    })
+    # Fetch orders assigned to this delivery boy with pending or picked status;
+    # chef and customer details are snapshotted on the order
+    orders_cursor = db["orders"].find(
+        {"delivery_boy_id": delivery_id, "delivery_status": {"$in": ["assigned", "picked"]}},
+        {**LISTING_EXCLUDE, "rider_summary": 0}
+    )
 
     orders = await orders_cursor.to_list(length=None)
 
@@ -171,14 +186,14 @@ async def get_my_orders(current_user: dict = Depends(get_current_user)):
             item["food_id"] = str(item.get("food_id", ""))
             item["chef_id"] = str(item.get("chef_id", ""))
 
-        # Fetch chef info
-        chef = await db["chef_user"].find_one({"_id": ObjectId(order["chef_id"])})
+        # Chef info
+        chef = order.pop("chef_summary", None)
         if chef:
             order["chef"] = {
                 "name": chef.get("name"),
-                "phone": chef.get("phone_number"),
+                "phone": chef.get("phone"),
                 "location": chef.get("location"),
-                "profile_pic": chef.get("photo_url"),
+                "profile_pic": chef.get("profile_pic"),
             }
         else:
             order["chef"] = {
@@ -188,12 +203,12 @@ async def get_my_orders(current_user: dict = Depends(get_current_user)):
                 "profile_pic": None,
             }
 
-        # Fetch customer info
-        customer = await db["app_user"].find_one({"_id": ObjectId(order["user_id"])})
+        # Customer info
+        customer = order.pop("customer_summary", None)
         if customer:
             order["customer"] = {
                 "name": customer.get("name"),
-                "phone": customer.get("phone_number"),
+                "phone": customer.get("phone"),
                 "email": customer.get("email"),
                 "location": customer.get("location"),
             }
@@ -216,7 +231,7 @@ async def get_my_orders(current_user: dict = Depends(get_current_user)):
 # order status
 from bson import ObjectId, errors
 @router.get("/orderstatus/{order_id}")
-async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
+async def get_order(order_id: str, current_user: Principal = Depends(get_current_principal)):
 
     # Only allow ObjectId if it's valid
     try:
@@ -232,7 +247,7 @@ async def get_order(order_id: str, current_user: dict = Depends(get_current_user
         raise HTTPException(status_code=404, detail="Order not found")
 
     # Delivery boy check
-    if current_user.get("role") == "delivery" and str(order.get("delivery_boy_id")) != str(current_user["_id"]):
+    if current_user.role == "delivery" and str(order.get("delivery_boy_id")) != current_user.id:
         raise HTTPException(status_code=403, detail="You cannot access this order")
 
     # Convert IDs to strings for JSON
@@ -331,6 +346,10 @@ async def update_order_status(
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to update order status")
 
+    # ✅ Push the delta to everyone following this order
+    rider_orders.invalidate(str(current_user["_id"]))
+    await publish_order_event(order, update_data)
+
     # ✅ Return updated response
     return {
         "status": "success",
@@ -342,14 +361,22 @@ async def update_order_status(
 #---------------------DELIVEERY BOY ORDER HISTORY-----------------#
 # delivery boy order tracking
 @router.get("/deliveryboy/orders")
-async def get_deliveryboy_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "delivery":
+async def get_deliveryboy_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.role != "delivery":
         raise HTTPException(status_code=403, detail="Only delivery boys can access this endpoint")
 
-    delivery_boy_id = str(current_user["_id"])
+    delivery_boy_id = current_user.id
 
-    # Fetch all orders assigned to this delivery boy
-    orders = await db["orders"].find({"delivery_boy_id": delivery_boy_id}).sort("created_at", -1).to_list(length=None)
+    # One page of orders assigned to this delivery boy, newest first; customer
+    # and chef details are snapshotted on the order
+    orders, next_cursor = await paginate(
+        db["orders"], {"delivery_boy_id": delivery_boy_id}, cursor, limit,
+        projection={**LISTING_EXCLUDE, "rider_summary": 0}
+    )
 
     ongoing_orders = []
     past_orders = []
@@ -360,19 +387,19 @@ async def get_deliveryboy_orders(current_user: dict = Depends(get_current_user))
         order["chef_id"] = str(order["chef_id"])
         order["delivery_boy_id"] = str(order["delivery_boy_id"])
 
-        # Fetch customer details
-        user = await db["users"].find_one({"_id": ObjectId(order["user_id"])})
+        # Customer details
+        user = order.pop("customer_summary", None) or {}
         order["customer"] = {
-            "name": user.get("name") if user else "Unknown",
-            "phone": user.get("phone") if user else None
+            "name": user.get("name") or "Unknown",
+            "phone": user.get("phone")
         }
 
-        # Fetch chef details
-        chef = await db["chef_user"].find_one({"_id": ObjectId(order["chef_id"])})
+        # Chef details
+        chef = order.pop("chef_summary", None) or {}
         order["chef"] = {
-            "name": chef.get("name") if chef else "Unknown",
-            "profile_pic": chef.get("photo_url") if chef else None,
-            "location": chef.get("location") if chef else None
+            "name": chef.get("name") or "Unknown",
+            "profile_pic": chef.get("profile_pic"),
+            "location": chef.get("location")
         }
 
         # Categorize based on delivery status
@@ -386,34 +413,23 @@ async def get_deliveryboy_orders(current_user: dict = Depends(get_current_user))
     return {
         "status": "success",
         "ongoing_orders": ongoing_orders,
-        "past_orders": past_orders
+        "past_orders": past_orders,
+        "next_cursor": next_cursor
     }
 
 # ------------------- Delivery Profile Update -------------------
-def save_image_and_get_url(contents: bytes, filename: str = None) -> str:
-    # Make sure folder exists
-    os.makedirs(UPLOAD_DIR_PROFILE, exist_ok=True)
-
-    # Create unique filename
-    ext = filename.split(".")[-1] if filename else "jpg"
-    unique_name = f"{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR_PROFILE, unique_name)
-
-    # Save file
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    # Return URL relative to static mount
-    return f"/static/chefprofile/{unique_name}"
+async def save_image_and_get_url(upload: UploadFile, allowed: dict = IMAGE_TYPES) -> str:
+    # Content-addressed: same bytes, same immutable URL (services/media.py)
+    return await store_upload(upload, allowed=allowed)
 
 
 
 @router.get("/orders/delivery/me")
-async def get_my_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "delivery":
+async def get_my_orders(current_user: Principal = Depends(get_current_principal)):
+    if current_user.role != "delivery":
         raise HTTPException(status_code=403, detail="Only delivery users can access")
 
-    delivery_id = str(current_user["_id"])
+    delivery_id = current_user.id
 
     # Fetch orders assigned to this delivery boy with pending or picked status
     orders = await db["orders"].find({
@@ -483,19 +499,29 @@ async def track_order(order_id: str):
 
 
 @router.get("/delivery/orders/delivered")
-async def get_delivered_orders(current_user: dict = Depends(get_current_user)):
+async def get_delivered_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
     """
     Fetch all delivered orders for the logged-in delivery boy.
     """
-    if current_user["role"] != "delivery":
+    if current_user.role != "delivery":
         raise HTTPException(status_code=403, detail="Only delivery users can access this")
 
-    delivery_boy_id = str(current_user["_id"])
+    delivery_boy_id = current_user.id
 
-    # Fetch all delivered orders assigned to this delivery user
-    orders = await db["orders"].find(
-        {"delivery_boy_id": delivery_boy_id, "delivery_status": "delivered"}
-    ).to_list(length=None)
+    # Fetch one page of delivered orders assigned to this delivery user
+    orders, next_cursor = await paginate(
+        db["orders"], {"delivery_boy_id": delivery_boy_id, "delivery_status": "delivered"}, cursor, limit
+    )
+
+    # Fetch users and chefs for all orders at once
+    users, chefs = await asyncio.gather(
+        fetch_related(orders, "user_id", "app_user"),
+        fetch_related(orders, "chef_id", "chef_user"),
+    )
 
     result = []
 
@@ -505,8 +531,8 @@ async def get_delivered_orders(current_user: dict = Depends(get_current_user)):
         order["chef_id"] = str(order["chef_id"])
         order["delivery_boy_id"] = str(order.get("delivery_boy_id", ""))
 
-        # Fetch user info
-        user = await db["app_user"].find_one({"_id": ObjectId(order["user_id"])})
+        # User info
+        user = users.get(order["user_id"])
         order["user"] = {
             "name": user.get("name") if user else "Unknown",
             "email": user.get("email") if user else None,
@@ -515,8 +541,8 @@ async def get_delivered_orders(current_user: dict = Depends(get_current_user)):
             "address": user.get("address") if user else None,
         }
 
-        # Fetch chef info
-        chef = await db["chef_user"].find_one({"_id": ObjectId(order["chef_id"])})
+        # Chef info
+        chef = chefs.get(order["chef_id"])
         order["chef"] = {
             "name": chef.get("name") if chef else "Unknown",
             "phone": chef.get("phone_number") if chef else None,
@@ -531,4 +557,4 @@ async def get_delivered_orders(current_user: dict = Depends(get_current_user)):
 
         result.append(order)
 
-    return {"status": "success", "orders": result}
\ No newline at end of file
+    return {"status": "success", "orders": result, "next_cursor": next_cursor}
\ No newline at end of file
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends
 from models.foodstyle import FoodStyle
 from database import db
-from auth.jwt_handler import get_current_user  # ✅ 
+from auth.jwt_handler import get_current_principal, Principal  # ✅ 
+from services.serialization import MongoJSONRoute
 
 router = APIRouter(
-    dependencies=[Depends(get_current_user)]  # ✅ this makes all routes below protected
+    route_class=MongoJSONRoute,
+    dependencies=[Depends(get_current_principal)]  # ✅ this makes all routes below protected
 )
 
 @router.post("/food-styles")
@@ -17,8 +19,8 @@ async def create_food_style(style: FoodStyle):
     return {"message": "Created", "id": str(result.inserted_id)}
 
 @router.get("/food-styles")
-async def get_all_food_styles(current_user: dict = Depends(get_current_user)):
-    username = current_user.get("phone_number")
+async def get_all_food_styles(current_user: Principal = Depends(get_current_principal)):
+    username = current_user.phone_number
     print(username)
     styles = await db["food_styles"].find().to_list(100)
     return {
@@ -0,0 +1,21 @@
+# routers/media.py
+from fastapi import APIRouter, Request
+from services.media_serving import serve_file
+from services.serialization import MongoJSONRoute
+import os
+
+router = APIRouter(route_class=MongoJSONRoute)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
+
+# Older rider photos were saved to uploads/profile but linked as /static/chefprofile/
+STATIC_FALLBACKS = {"chefprofile/": "profile/"}
+
+
+# Everything under uploads/ (media store, legacy profile folders) at /static/...
+@router.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def get_static_file(path: str, request: Request):
+    fallbacks = [alias + path[len(prefix):] for prefix, alias in STATIC_FALLBACKS.items()
+                 if path.startswith(prefix)]
+    return await serve_file(request, UPLOADS_DIR, path, fallbacks)
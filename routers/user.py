@@ -1,7 +1,8 @@
 # routers/user.py
-from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect,Form,File,UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect,Form,File,UploadFile,Header
+from fastapi.responses import StreamingResponse
 from bson import ObjectId
-from auth.jwt_handler import get_current_user
+from auth.jwt_handler import get_current_user, get_current_principal, invalidate_principal, decode_token, Principal
 from models.user import FoodFilter   # adjust path to your actual file
 from database import get_db
 from models.user import UserCreate
@@ -12,15 +13,30 @@ from datetime import datetime
 import asyncio
 import uuid
 from typing import List, Optional
-
-router = APIRouter()
+from services.pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.facets import food_style_key, service_type_key, food_type_key
+from services.search import search_index
+from services.ratings import record_review, format_rating_summary, compute_rating_summary
+from services.partners import partner_index
+from services.distance import distances_from, sort_by_distance
+from services.dispatch import assign_order, mark_partner_offline
+from services.broker import broker
+from services.order_events import order_events, publish_order_event, stream_order_events
+from services.locations import record_location
+from services.cart import update_cart, cart_line
+from services.items import get_item_metadata, get_items_metadata
+from services.checkout import place_order
+from services.media import store_upload, update_media_refs, media_projection, MEDIA_FOLDER, MEDIA_URL_PREFIX
+from services.images import process_photo_later
+from services.serialization import MongoJSONRoute
+from services.order_summary import refresh_order_summaries_later, LISTING_EXCLUDE
+from pymongo import ReturnDocument
+
+router = APIRouter(route_class=MongoJSONRoute)
 
 
 @router.get("/userme")
 async def get_my_profile(current_user: dict = Depends(get_current_user)):
-    # Convert ObjectId to string for JSON serialization
-    current_user["_id"] = str(current_user["_id"])
-    
     return current_user
 
 @router.post("/users")
@@ -98,40 +114,30 @@ async def update_user_profile(
     if email:
         update_data["email"] = email
     if file:
-        contents = await file.read()
-        photo_url = save_image_and_get_url(contents, file.filename)
+        photo_url = await save_image_and_get_url(file)
         update_data["photo_url"] = photo_url
+        update_data["photo_variants"] = None  # rebuilt in the background
 
     if update_data:
-        await db["app_user"].update_one(
+        before = await db["app_user"].find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=media_projection("app_user")
         )
+        await update_media_refs("app_user", before, update_data)
+        invalidate_principal("user", user_id)
+        refresh_order_summaries_later("user", user_id, update_data)
+        if file:
+            process_photo_later("app_user", ObjectId(user_id), update_data["photo_url"], MEDIA_FOLDER, MEDIA_URL_PREFIX)
 
     return {"message": "Profile updated successfully", "updated": update_data}
 
 
 from fastapi import APIRouter, UploadFile, File, Form, Depends
-import os
-import uuid
-
-UPLOAD_FOLDER = "uploads/userprofile"  # folder for chef profile images
-
-def save_image_and_get_url(contents: bytes, filename: str = None) -> str:
-    # Make sure folder exists
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-    # Create unique filename
-    ext = filename.split(".")[-1] if filename else "jpg"
-    unique_name = f"{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(UPLOAD_FOLDER, unique_name)
-
-    # Save file
-    with open(filepath, "wb") as f:
-        f.write(contents)
-
-    # Return URL relative to static mount
-    return f"/static/userprofile/{unique_name}"
+async def save_image_and_get_url(upload: UploadFile) -> str:
+    # Content-addressed: same bytes, same immutable URL (services/media.py)
+    return await store_upload(upload)
 
 @router.post("/userlocation/update")
 async def update_location(
@@ -141,20 +147,24 @@ async def update_location(
     # safer: use sub instead of _id
     user_id = current_user.get("_id")  
 
+    update_data = {
+        "location": {
+            "type": "Point",
+            "coordinates": [location.longitude, location.latitude],
+            "address": location.address
+        }
+    }
     result = await db["app_user"].update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": {
-            "location": {
-                "type": "Point",
-                "coordinates": [location.longitude, location.latitude],
-                "address": location.address
-            }
-        }}
+        {"$set": update_data}
     )
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
+    invalidate_principal("user", user_id)
+    refresh_order_summaries_later("user", user_id, update_data)
+
     return {"status": "success", "message": "Location updated"}
 
 
@@ -176,49 +186,39 @@ async def update_location(
 
 
 @router.get("/items/style/{food_style}")
-async def get_items_by_style(food_style: str):
-    food_style = food_style.strip()
-    items = await db["food_items"].find({
-        "food_style": {"$regex": f"\\s*{food_style}\\s*", "$options": "i"}
-    }).to_list(length=None)
+async def get_items_by_style(
+    food_style: str,
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+):
+    query = {"food_style_key": food_style_key(food_style)}
+    items, next_cursor = await paginate(db["food_items"], query, cursor, limit, sort_field="_id")
 
-    for item in items:
-        item["_id"] = str(item["_id"])
-        item["chef_id"] = str(item["chef_id"])
+    # total covers every page, as it did before pagination
+    total_count = await db["food_items"].count_documents(query)
 
-    return {"total": len(items), "items": items}
+    return {"total": total_count, "items": items, "next_cursor": next_cursor}
 
 
 
 
 @router.get("/items/type/{food_type}")
-async def get_items_by_type(food_type: str):
-    food_type = food_type.strip()
-    items = await db["food_items"].find({
-        "food_type": {"$regex": f"\\s*{food_type}\\s*", "$options": "i"}
-    }).to_list(length=None)
-
-    for item in items:
-        item["_id"] = str(item["_id"])
-        item["chef_id"] = str(item["chef_id"])
+async def get_items_by_type(
+    food_type: str,
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+):
+    query = {"food_type_key": food_type_key(food_type)}
+    items, next_cursor = await paginate(db["food_items"], query, cursor, limit, sort_field="_id")
 
-    return {"total": len(items), "items": items}
+    # total covers every page, as it did before pagination
+    total_count = await db["food_items"].count_documents(query)
 
-def serialize_doc(doc):
-    """Convert MongoDB document to JSON-serializable dict."""
-    return {
-        "id": str(doc["_id"]),
-        "food_style": doc["food_style"],
-        "image_url": doc.get("image_url")
-    }
+    return {"total": total_count, "items": items, "next_cursor": next_cursor}
 
 @router.get("/all-food-styles/")
 async def get_all_food_styles():
-    cursor = db["food_styles"].find({})
-    styles = []
-    async for doc in cursor:
-        styles.append(serialize_doc(doc))
-    return styles
+    return await db["food_styles"].find({}).to_list(length=None)
 
 
 
@@ -233,26 +233,18 @@ async def get_items_by_type(
     limit: int = Query(20, gt=0, le=100, description="Maximum number of items to return")
 ):
     """
-    Get food items by food style (regex) and service type (exact match).
+    Get food items by food style and service type (normalized exact match).
     Supports pagination using skip and limit.
     """
-    food_type = food_type.strip()
-    category = category.strip()
-
     # Query MongoDB
     query = {
-        "food_style": {"$regex": f"\\s*{food_type}\\s*", "$options": "i"},
-        "service_type": category
+        "food_style_key": food_style_key(food_type),
+        "service_type_key": service_type_key(category)
     }
 
     items_cursor = db["food_items"].find(query).skip(skip).limit(limit)
     items = await items_cursor.to_list(length=limit)
 
-    # Convert ObjectId to string
-    for item in items:
-        item["_id"] = str(item["_id"])
-        item["chef_id"] = str(item["chef_id"])
-
     # Return total count for frontend pagination
     total_count = await db["food_items"].count_documents(query)
 
@@ -272,89 +264,87 @@ async def get_filtered_food_items(
     food_styles: list[str] = None,
     service_types: list[str] = None,
     menu_types: list[str] = None,
-    sort_by: str = None
+    sort_by: str = None,
+    cursor: str = None,
+    limit: int = None
 ):
     filters = {}
 
-    conditions = []
-
     # Food Style
     if food_styles:
-        conditions.extend([
-            {"food_style": {"$regex": f"\\s*{fs}\\s*", "$options": "i"}}
-            for fs in food_styles
-        ])
+        filters["food_style_key"] = {"$in": [food_style_key(fs) for fs in food_styles]}
 
     # Service Type
     if service_types:
-        conditions.extend([
-            {"service_type": {"$regex": f"\\s*{st}\\s*", "$options": "i"}}
-            for st in service_types
-        ])
+        filters["service_type_key"] = {"$in": [service_type_key(st) for st in service_types]}
 
     # Menu Type
     if menu_types:
-        conditions.extend([
-            {"food_type": {"$regex": f"\\s*{mt}\\s*", "$options": "i"}}
-            for mt in menu_types
-        ])
-
-    if conditions:
-        filters["$and"] = conditions   # combine all conditions
-
-    # Build query
-    cursor = db["food_items"].find(filters)
+        filters["food_type_key"] = {"$in": [food_type_key(mt) for mt in menu_types]}
 
     # Sort
+    sort_field = "_id"
     if sort_by and sort_by.lower() == "top rated":
-        cursor = cursor.sort("rating", -1)
-
-    # Return list
-    items = await cursor.to_list(length=None)
-    return items
-
-def serialize_doc(doc: dict) -> dict:
-    """Convert MongoDB document to JSON serializable dict."""
-    serialized = {}
-    for key, value in doc.items():
-        if isinstance(value, ObjectId):
-            serialized[key] = str(value)
-        elif isinstance(value, list):
-            serialized[key] = [
-                str(v) if isinstance(v, ObjectId) else v for v in value
-            ]
-        else:
-            serialized[key] = value
-    return serialized
+        sort_field = "rating"
+
+    # Return one page of items and the token for the next one
+    return await paginate(db["food_items"], filters, cursor, limit, sort_field=sort_field)
 
 @router.post("/filter-food")
-async def filter_food(filter_data: FoodFilter, db=Depends(get_db)):
-    items = await get_filtered_food_items(
+async def filter_food(
+    filter_data: FoodFilter,
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    db=Depends(get_db)
+):
+    items, next_cursor = await get_filtered_food_items(
         db,
         food_styles=filter_data.food_styles,
         service_types=filter_data.service_types,
         menu_types=filter_data.menu_types,
-        sort_by=filter_data.sort_by
+        sort_by=filter_data.sort_by,
+        cursor=cursor,
+        limit=limit
     )
 
-    serialized_items = [serialize_doc(item) for item in items]
+    return {"count": len(items), "items": items, "next_cursor": next_cursor}
+
+
+
+
 
-    return {"count": len(serialized_items), "items": serialized_items}
 
 
 
+#-------------------------------------------------Search--------------------------------------------------------#
+@router.get("/search")
+async def search_catalog(
+    q: str = Query(..., min_length=1, description="Search text, the last word may be partial"),
+    type: Optional[str] = Query(None, description="Restrict results to 'item' or 'chef'"),
+    lat: Optional[float] = Query(None, description="Rank nearer chefs higher"),
+    lon: Optional[float] = Query(None, description="Rank nearer chefs higher"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+):
+    if type not in (None, "item", "chef"):
+        raise HTTPException(status_code=400, detail="type must be 'item' or 'chef'")
 
+    origin = [lon, lat] if lat is not None and lon is not None else None
+    results = search_index.search(q, limit=limit, kind=type, origin=origin)
+    return {"status": "success", "count": len(results), "results": results}
 
 
+@router.get("/search/suggest")
+async def search_suggest(q: str = Query(..., min_length=1), limit: int = Query(10, gt=0, le=50)):
+    return {"status": "success", "suggestions": search_index.suggest(q, limit=limit)}
 
 
 #-------------------------------------------------Near by --------------------------------------------------------#
 @router.get("/chefs/nearby")
 async def get_nearby_chefs(
     max_distance_m: int = 5000,  # default 5 km
-    current_user: dict = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
-    user_id = current_user["_id"]
+    user_id = current_user.id
 
     # 1️⃣ Get current user location
     user = await db["app_user"].find_one({"_id": ObjectId(user_id)})
@@ -370,6 +360,8 @@ async def get_nearby_chefs(
         "location": 1,
         "address": 1,
         "photo_url":1,
+        "rating": 1,
+        "rating_summary.count": 1,
     }
 
 
@@ -388,24 +380,23 @@ async def get_nearby_chefs(
         projection=projection_fields
     ).to_list(100)
 
-    nearby_chefs = [convert_objectid(c) for c in nearby_chefs]
+    nearby_chefs = sort_by_distance(
+        user_location, nearby_chefs, lambda c: (c.get("location") or {}).get("coordinates")
+    )
 
     return {"status": "success", "chefs": nearby_chefs}
 
-def convert_objectid(doc):
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
-
 
 
 #-----------------------------------------------------------------Near-by ----------------------------------------------------#
 @router.get("/food/nearby")
 async def get_nearby_chef_food(
     max_distance_m: int = 5000,  # default 5 km
-    current_user: dict = Depends(get_current_user)
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    user_id = current_user["_id"]
+    user_id = current_user.id
 
     # 1️⃣ Get current user location
     user = await db["app_user"].find_one({"_id": ObjectId(user_id)})
@@ -431,18 +422,28 @@ async def get_nearby_chef_food(
         return {"status": "success", "items": [], "message": "No nearby chefs found"}
 
     chef_ids = [c["_id"] for c in nearby_chefs]
-
-    # 3️⃣ Get food items for those chefs
-    food_items = await db["food_items"].find({
+    located_chefs = [c for c in nearby_chefs if (c.get("location") or {}).get("coordinates")]
+    chef_distances = dict(zip(
+        (str(c["_id"]) for c in located_chefs),
+        distances_from(user_location, [c["location"]["coordinates"] for c in located_chefs]).tolist()
+    ))
+
+    # 3️⃣ Get one page of food items for those chefs
+    food_items, next_cursor = await paginate(db["food_items"], {
         "chef_id": {"$in": chef_ids}
-    }).to_list(length=None)
+    }, cursor, limit, sort_field="_id")
 
-    # Convert ObjectId to string
+    # Convert ObjectId to string and attach the chef's distance
     for item in food_items:
         item["_id"] = str(item["_id"])
         item["chef_id"] = str(item["chef_id"])
+        distance = chef_distances.get(item["chef_id"])
+        item["distance_meters"] = round(distance, 2) if distance is not None else None
 
-    return {"status": "success", "count": len(food_items), "items": food_items}
+    # Nearest first within the page
+    food_items.sort(key=lambda i: i["distance_meters"] if i["distance_meters"] is not None else float("inf"))
+
+    return {"status": "success", "count": len(food_items), "items": food_items, "next_cursor": next_cursor}
 
 
 
@@ -465,11 +466,6 @@ async def get_food_by_chef(chef_id: str):
         "chef_id": chef_obj_id
     }).to_list(length=None)
 
-    # Convert ObjectId to string
-    for item in food_items:
-        item["_id"] = str(item["_id"])
-        item["chef_id"] = str(item["chef_id"])
-
     # 3️⃣ Group by service_type
     grouped_items = {
         "Breakfast": [],
@@ -492,6 +488,8 @@ async def get_food_by_chef(chef_id: str):
             "_id": str(chef["_id"]),
             "name": chef.get("name"),
             "address": chef.get("address"),
+            "rating": chef.get("rating"),
+            "review_count": chef.get("rating_summary", {}).get("count", 0),
         },
         "count": len(food_items),
         "items": grouped_items
@@ -505,10 +503,11 @@ async def add_review(
     current_user: dict = Depends(get_current_user)
 ):
     user_id = current_user["_id"]
+    chef_obj_id = ObjectId(review.chef_id)
 
     review_doc = {
         "user_id": ObjectId(user_id),
-        "chef_id": ObjectId(review.chef_id),
+        "chef_id": chef_obj_id,
         "taste_rating": review.taste_rating,
         "portion_rating": review.portion_rating,
         "review_text": review.review_text,
@@ -517,6 +516,11 @@ async def add_review(
 
     result = await db["chef_reviews"].insert_one(review_doc)
 
+    # ✅ Keep the chef's running rating aggregates up to date
+    chef = await record_review(chef_obj_id, review.taste_rating, review.portion_rating)
+    if chef:
+        search_index.update_chef_rating(review.chef_id, chef["rating"])
+
     return {
         "status": "success",
         "review_id": str(result.inserted_id)
@@ -525,38 +529,33 @@ async def add_review(
 
 #-----------------------------------------------------get review-----------------------------------#
 @router.get("/chef/{chef_id}/reviews")
-async def get_chef_reviews(chef_id: str):
+async def get_chef_reviews(
+    chef_id: str,
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+):
     try:
         chef_obj_id = ObjectId(chef_id)
     except:
         return {"status": "error", "message": "Invalid chef_id"}
 
-    reviews = await db["chef_reviews"].find(
-        {"chef_id": chef_obj_id}
-    ).sort("created_at", -1).to_list(length=None)
-
-    # Convert ObjectId to string
-    for r in reviews:
-        r["_id"] = str(r["_id"])
-        r["user_id"] = str(r["user_id"])
-        r["chef_id"] = str(r["chef_id"])
-        r["created_at"] = r["created_at"].isoformat()
+    reviews, next_cursor = await paginate(db["chef_reviews"], {"chef_id": chef_obj_id}, cursor, limit)
 
-    # ✅ Optional: calculate average ratings
-    if reviews:
-        avg_taste = sum(r["taste_rating"] for r in reviews) / len(reviews)
-        avg_portion = sum(r["portion_rating"] for r in reviews) / len(reviews)
-    else:
-        avg_taste = avg_portion = 0
+    # ✅ Average ratings come from the precomputed per-chef aggregates
+    chef = await db["chef_user"].find_one({"_id": chef_obj_id}, {"rating_summary": 1})
+    summary = (chef or {}).get("rating_summary")
+    if summary is None and reviews:
+        # chef not backfilled yet
+        summary = await compute_rating_summary(chef_obj_id)
+    summary = format_rating_summary(summary)
 
     return {
         "status": "success",
-        "count": len(reviews),
-        "average_ratings": {
-            "taste": round(avg_taste, 1),
-            "portion": round(avg_portion, 1)
-        },
-        "reviews": reviews
+        "count": summary["count"],
+        "average_ratings": summary["average_ratings"],
+        "histogram": summary["histogram"],
+        "reviews": reviews,
+        "next_cursor": next_cursor
     }
 
 
@@ -583,7 +582,9 @@ async def get_chef_about(chef_id: str):
     return {
         "status": "success",
         "chef_id": str(chef["_id"]),
-        "about": about_data
+        "about": about_data,
+        "rating": chef.get("rating"),
+        "rating_summary": format_rating_summary(chef.get("rating_summary"))
     }
 
 #--------------------------------------------------all fod of particulat chef-------------------------------#
@@ -604,11 +605,6 @@ async def get_food_by_chef(chef_id: str):
         "chef_id": chef_obj_id
     }).to_list(length=None)
 
-    # Convert ObjectId to string
-    for item in food_items:
-        item["_id"] = str(item["_id"])
-        item["chef_id"] = str(item["chef_id"])
-
     # 3️⃣ Group by service_type
     grouped_items = {
         "Breakfast": [],
@@ -631,6 +627,8 @@ async def get_food_by_chef(chef_id: str):
             "_id": str(chef["_id"]),
             "name": chef.get("name"),
             "address": chef.get("address"),
+            "rating": chef.get("rating"),
+            "review_count": chef.get("rating_summary", {}).get("count", 0),
         },
         "count": len(food_items),
         "items": grouped_items
@@ -641,19 +639,6 @@ async def get_food_by_chef(chef_id: str):
 
 
 #--------------------------------------------------------USER CART-------------------------#
-from fastapi.encoders import jsonable_encoder\
-
-def convert_mongo_document(doc):
-    """Recursively convert ObjectId and datetime to strings."""
-    if isinstance(doc, dict):
-        return {k: convert_mongo_document(v) for k, v in doc.items()}
-    elif isinstance(doc, list):
-        return [convert_mongo_document(i) for i in doc]
-    elif isinstance(doc, ObjectId):
-        return str(doc)
-    elif isinstance(doc, datetime):
-        return doc.isoformat()
-    return doc
 
 @router.post("/cart/add")
 async def add_to_cart(item: CartItemRequest, current_user: dict = Depends(get_current_user)):
@@ -662,45 +647,19 @@ async def add_to_cart(item: CartItemRequest, current_user: dict = Depends(get_cu
     
     user_id = str(current_user["_id"])
 
-    food_item = await db["food_items"].find_one({"_id": ObjectId(item.food_id)})
+    if not ObjectId.is_valid(item.food_id):
+        raise HTTPException(status_code=400, detail="Invalid food ID")
+    food_item = await get_item_metadata(item.food_id)
     if not food_item:
         raise HTTPException(status_code=404, detail="Food item not found")
 
-    cart = await db["carts"].find_one({"user_id": user_id})
-    if not cart:
-        cart = {
-            "user_id": user_id,
-            "items": [],
-            "total_price": 0,
-            "last_update": datetime.utcnow()
-        }
-
-    # ✅ Always increase quantity by 1
-    for cart_item in cart["items"]:
-        if cart_item["food_id"] == str(food_item["_id"]):
-            cart_item["quantity"] += 1
-            break
-    else:
-        cart["items"].append({
-            "food_id": str(food_item["_id"]),
-            "chef_id": str(food_item["chef_id"]),
-            "food_name": food_item["food_name"],
-            "quantity": 1,  # start at 1
-            "price": food_item["price"],
-            "photo_url":food_item["photo_url"]
-        })
-
-    cart["total_price"] = sum(i["price"] * i["quantity"] for i in cart["items"])
-    cart["last_update"] = datetime.utcnow()
-
-    await db["carts"].update_one(
-        {"user_id": user_id},
-        {"$set": cart},
-        upsert=True
+    # ✅ Always increase quantity by 1 (new line starts at 1), in one atomic write
+    cart = await update_cart(
+        user_id,
+        deltas={item.food_id: 1},
+        new_lines=[cart_line(food_item, 1)]
     )
-
-    saved_cart = await db["carts"].find_one({"user_id": user_id})
-    return {"status": "success", "cart": convert_mongo_document(saved_cart)}
+    return {"status": "success", "cart": cart}
 
 
 #-------------------------------remove cart----------------------#
@@ -711,63 +670,65 @@ async def remove_from_cart(item: CartItemRequest, current_user: dict = Depends(g
     
     user_id = str(current_user["_id"])
 
-    cart = await db["carts"].find_one({"user_id": user_id})
-    if not cart or not cart.get("items"):
-        raise HTTPException(status_code=404, detail="Cart is empty")
-
-    updated_items = []
-    item_removed = False
-
-    for cart_item in cart["items"]:
-        if cart_item["food_id"] == item.food_id:
-            # ✅ Always decrease by 1
-            if cart_item["quantity"] > 1:
-                cart_item["quantity"] -= 1
-                updated_items.append(cart_item)
-            else:
-                item_removed = True
-                continue
-        else:
-            updated_items.append(cart_item)
-
-    if not updated_items and not item_removed:
+    # ✅ Always decrease by 1; the line disappears at 0
+    cart = await update_cart(user_id, deltas={item.food_id: -1}, require_item=item.food_id)
+    if cart is None:
+        if not await db["carts"].find_one({"user_id": user_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Cart is empty")
         raise HTTPException(status_code=404, detail="Item not found in cart")
 
-    cart["items"] = updated_items
-    cart["total_price"] = sum(i["price"] * i["quantity"] for i in cart["items"])
-    cart["last_update"] = datetime.utcnow()
-
     if not cart["items"]:
-        await db["carts"].delete_one({"user_id": user_id})
         return {"status": "success", "message": "Cart is now empty"}
+    return {"status": "success", "cart": cart}
 
-    await db["carts"].update_one(
-        {"user_id": user_id},
-        {"$set": cart},
-        upsert=True
+
+#-------------------------------set quantities----------------------#
+@router.put("/cart/items")
+async def set_cart_quantities(items: List[CartItemRequest], current_user: dict = Depends(get_current_user)):
+    """Set the quantity of many lines at once; quantity 0 removes the line."""
+    if current_user["role"] != "user":
+        raise HTTPException(status_code=403, detail="Only app users can update the cart")
+    if not items:
+        raise HTTPException(status_code=400, detail="No items given")
+
+    user_id = str(current_user["_id"])
+
+    quantities = {}
+    for item in items:
+        if not ObjectId.is_valid(item.food_id):
+            raise HTTPException(status_code=400, detail=f"Invalid food ID {item.food_id}")
+        if item.quantity < 0:
+            raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+        quantities[item.food_id] = item.quantity
+
+    # Lines that may be new need the item's name and price
+    wanted = [food_id for food_id, quantity in quantities.items() if quantity > 0]
+    food_items = await get_items_metadata(wanted)
+    missing = [food_id for food_id in wanted if food_id not in food_items]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Food items not found: {missing}")
+
+    cart = await update_cart(
+        user_id,
+        quantities=quantities,
+        new_lines=[cart_line(food_items[food_id], quantities[food_id]) for food_id in wanted]
     )
 
-    saved_cart = await db["carts"].find_one({"user_id": user_id})
-    return {"status": "success", "cart": convert_mongo_document(saved_cart)}
+    if not cart["items"]:
+        return {"status": "success", "message": "Cart is now empty"}
+    return {"status": "success", "cart": cart}
 
 
 #---------------------------------------------------get cart item-------------------------------#
 @router.get("/cart/me")
-async def get_my_cart(current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["_id"])  # ensure string
+async def get_my_cart(current_user: Principal = Depends(get_current_principal)):
+    user_id = current_user.id
 
     # ✅ Query with string user_id (not ObjectId)
     cart = await db["carts"].find_one({"user_id": user_id})
     if not cart:
         return {"status": "success", "cart": []}
 
-    # ✅ Convert ObjectIds to strings
-    cart["_id"] = str(cart["_id"])
-    cart["user_id"] = str(cart["user_id"])
-    for item in cart.get("items", []):
-        if "food_id" in item:
-            item["food_id"] = str(item["food_id"])
-
     return {"status": "success", "cart": cart}
 
 
@@ -798,14 +759,10 @@ async def add_address(address: Address, current_user: dict = Depends(get_current
 # Get all addresses
 # -------------------
 @router.get("/user/address")
-async def get_addresses(current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["_id"])
+async def get_addresses(current_user: Principal = Depends(get_current_principal)):
+    user_id = current_user.id
     addresses = await db["addresses"].find({"user_id": user_id}).to_list(100)
 
-    # Convert MongoDB ObjectId to string
-    for addr in addresses:
-        addr["_id"] = str(addr["_id"])
-
     return {"addresses": addresses}
 
 # -------------------
@@ -849,77 +806,46 @@ async def delete_address(address_id: str, current_user: dict = Depends(get_curre
 #-----------------------------------------Create Order------------------------------------#
 
 @router.post("/orders/create")
-async def create_order(current_user: dict = Depends(get_current_user)):
+async def create_order(
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] != "user":
         raise HTTPException(status_code=403, detail="Only users can create orders")
 
     user_id = str(current_user["_id"])
 
-    # Fetch user's cart
-    cart = await db["carts"].find_one({"user_id": user_id})
-    if not cart or not cart.get("items"):
-        raise HTTPException(status_code=400, detail="Cart is empty")
-
-    # Fetch the default address
-    address = await db["addresses"].find_one({"user_id": user_id, "is_default": True})
-    if not address:
-        raise HTTPException(status_code=404, detail="No default address found")
-
-    # Convert ObjectId to string
-    address["_id"] = str(address["_id"])
-
-    chef_id = cart["items"][0]["chef_id"]  # assume same chef for all items
-
-    # Create new order
-    order = {
-        "user_id": user_id,
-        "chef_id": chef_id,
-        "items": cart["items"],
-        "total_price": cart["total_price"],
-        "address": address,          # include the default address
-        "status": "pending",
-        "chef_status": "pending",
-        "delivery_status": "pending",
-        "created_at": datetime.utcnow()
-    }
-
-    result = await db["orders"].insert_one(order)
-    order["_id"] = str(result.inserted_id)
-
-    # Clear the cart
-    await db["carts"].delete_one({"user_id": user_id})
+    # Cart -> order in one transaction; retries with the same key get the same order
+    order, replayed = await place_order(user_id, idempotency_key, customer=current_user)
 
     return {
         "status": "success",
-        "message": "Order created successfully",
+        "message": "Order already created" if replayed else "Order created successfully",
         "order": order
     }
 
 
 @router.get("/orders/user")
-async def get_user_orders(current_user: dict = Depends(get_current_user)):
-    """Get all orders placed by the user."""
-    if current_user["role"] != "user":
+async def get_user_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Get the orders placed by the user, newest first, one page at a time."""
+    if current_user.role != "user":
         raise HTTPException(status_code=403, detail="Only users can view their orders")
 
-    user_id = str(current_user["_id"])
-    orders_cursor = db["orders"].find({"user_id": user_id}).sort("created_at", -1)
+    user_id = current_user.id
+    orders, next_cursor = await paginate(db["orders"], {"user_id": user_id}, cursor, limit)
 
-    orders = []
-    async for order in orders_cursor:
-        order["_id"] = str(order["_id"])
-        if "address" in order and "_id" in order["address"]:
-            order["address"]["_id"] = str(order["address"]["_id"])
-        orders.append(order)
-
-    return {"status": "success", "orders": orders}
+    return {"status": "success", "orders": orders, "next_cursor": next_cursor}
 
 #-------------------------------get individual order--------------------------#
 
 @router.get("/orders/user/{order_id}")
-async def get_user_order(order_id: str, current_user: dict = Depends(get_current_user)):
+async def get_user_order(order_id: str, current_user: Principal = Depends(get_current_principal)):
     """Get a specific order placed by the user."""
-    if current_user["role"] != "user":
+    if current_user.role != "user":
         raise HTTPException(status_code=403, detail="Only users can view this")
 
     try:
@@ -927,14 +853,10 @@ async def get_user_order(order_id: str, current_user: dict = Depends(get_current
     except:
         raise HTTPException(status_code=400, detail="Invalid order ID")
 
-    order = await db["orders"].find_one({"_id": oid, "user_id": str(current_user["_id"])})
+    order = await db["orders"].find_one({"_id": oid, "user_id": current_user.id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order["_id"] = str(order["_id"])
-    if "address" in order and "_id" in order["address"]:
-        order["address"]["_id"] = str(order["address"]["_id"])
-
     return {"status": "success", "order": order}
 
 
@@ -969,9 +891,10 @@ async def chef_response(payload: ChefResponseRequest, current_user: dict = Depen
     chef_status = "accepted" if response == "accept" else "rejected"
     status = "chef_accepted" if chef_status == "accepted" else "cancelled"
 
+    changes = {"chef_status": chef_status, "status": status}
     await db["orders"].update_one(
         {"_id": ObjectId(order_id)},
-        {"$set": {"chef_status": chef_status, "status": status}}
+        {"$set": changes}
     )
 
     # Assign delivery boy if chef accepted
@@ -983,189 +906,115 @@ async def chef_response(payload: ChefResponseRequest, current_user: dict = Depen
                 {"_id": ObjectId(order_id)},
                 {"$set": {"delivery_status": "pending_assignment"}}
             )
+            changes["delivery_status"] = "pending_assignment"
             # Fire-and-forget async assignment to nearby delivery boys
             asyncio.create_task(assign_order(order_id, chef_obj["location"]))
 
+    await publish_order_event(order, changes)
+
     return {
         "status": "success",
         "message": f"Order {response}ed successfully",
         "order_id": order_id,
         "chef_status": chef_status
     }
-import math
-
-# Active WebSocket connections (delivery_boy_id: websocket)
-active_connections = {}
-# Shared responses (order_id -> delivery_boy_id -> response)
-delivery_responses = {}  # Example: {"order123": {"boy1": "accept", "event": asyncio.Event()}}
-
 # MongoDB collections
 delivery_user = db["delivery_user"]
 orders_collection = db["orders"]
 
 
 # ------------------------------
-# Haversine Distance Function
-# ------------------------------
-def haversine(lon1, lat1, lon2, lat2):
-    R = 6371000  # Earth radius in meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    return R * c  # distance in meters
-
-
-# ------------------------------
-# Find Nearby Delivery Boys
-# ------------------------------
-async def find_nearby_delivery_boys(chef_location: dict, max_distance: int = 5000):
-    chef_lon, chef_lat = chef_location["coordinates"]
-
-    delivery_boys_cursor = db["delivery_user"].find({
-        "role": "delivery",
-        "status": True,  # must be online
-        "location": {
-            "$near": {
-                "$geometry": {"type": "Point", "coordinates": [chef_lon, chef_lat]},
-                "$maxDistance": max_distance
-            }
-        }
-    })
-
-    nearby_delivery_boys = []
-    async for delivery_boy in delivery_boys_cursor:
-        boy_lon, boy_lat = delivery_boy["location"]["coordinates"]
-        distance = haversine(chef_lon, chef_lat, boy_lon, boy_lat)
-
-        nearby_delivery_boys.append({
-            "id": str(delivery_boy["_id"]),
-            "name": delivery_boy.get("name"),
-            "location": delivery_boy.get("location"),
-            "distance_meters": round(distance, 2)
-        })
-
-    return nearby_delivery_boys
-
-# ------------------------------
-# Assign Order with Retry
+# Delivery Boy WebSocket
 # ------------------------------
-async def assign_order(order_id: str, chef_location: dict, max_distance: int = 5000, timeout: int = 30):
-    nearby_delivery_boys = await find_nearby_delivery_boys(chef_location, max_distance)
-
-    if not nearby_delivery_boys:
-        print(f"[DEBUG] No delivery boys available for order {order_id}")
-        return
+WS_AUTH_TIMEOUT = 10  # seconds a socket has to send its auth frame
 
-    if order_id not in delivery_responses:
-        delivery_responses[order_id] = {"event": asyncio.Event()}
 
-    for boy in nearby_delivery_boys:
-        delivery_boy_id = boy["id"]
-        if delivery_boy_id not in active_connections:
-            continue  # skip offline
-
-        ws = active_connections[delivery_boy_id]
-
-        # Send order request
-        await ws.send_json({
-            "type": "order_request",
-            "order_id": order_id,
-            "message": "New delivery request assigned to you!"
-        })
-        print(f"[DEBUG] Sent order request to {delivery_boy_id}")
+async def authenticate_partner_socket(websocket: WebSocket, delivery_boy_id: str, token: Optional[str]) -> bool:
+    """The socket's JWT must be a delivery token for `delivery_boy_id`.
 
+    Taken from ?token= or, failing that, a first {"type": "auth", "token": ..}
+    frame. Checked once per connection from the claims alone, no DB lookup.
+    """
+    if token is None:
         try:
-            # Wait until delivery boy responds or timeout
-            delivery_responses[order_id]["event"].clear()
-            try:
-                await asyncio.wait_for(delivery_responses[order_id]["event"].wait(), timeout=timeout)
-            except asyncio.TimeoutError:
-                print(f"[DEBUG] Delivery boy {delivery_boy_id} did not respond in {timeout}s")
-                continue  # try next nearby delivery boy
-
-            # Check response
-            response = delivery_responses[order_id].get(delivery_boy_id)
-            if response == "accept":
-                await orders_collection.update_one(
-                    {"_id": ObjectId(order_id)},
-                    {"$set": {
-                        "delivery_boy_id": delivery_boy_id,
-                        "delivery_status": "assigned",
-                        "accepted_at": datetime.utcnow()
-                    }}
-                )
-                print(f"[DEBUG] Order {order_id} assigned to {delivery_boy_id}")
-                await ws.send_json({"type": "order_status", "order_id": order_id, "status": "accepted"})
-                return
-            else:
-                print(f"[DEBUG] Delivery boy {delivery_boy_id} rejected order {order_id}")
-                continue  # next boy
-
-        except WebSocketDisconnect:
-            print(f"[DEBUG] Delivery boy {delivery_boy_id} disconnected")
-            if delivery_boy_id in active_connections:
-                del active_connections[delivery_boy_id]
-            continue
-
-    print(f"[DEBUG] No delivery boy accepted order {order_id}")
-    await orders_collection.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {"delivery_status": "unassigned"}}
-    )
+            frame = await asyncio.wait_for(websocket.receive_json(), timeout=WS_AUTH_TIMEOUT)
+        except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+            return False
+        if isinstance(frame, dict) and frame.get("type") == "auth":
+            token = frame.get("token")
+    if not isinstance(token, str) or not token:
+        return False
+    try:
+        payload = decode_token(token)
+    except HTTPException:
+        return False
+    return payload["role"] == "delivery" and payload["sub"] == delivery_boy_id
+
 
-# ------------------------------
-# Delivery Boy WebSocket
-# ------------------------------
 @router.websocket("/ws/delivery/{delivery_boy_id}")
-async def delivery_boy_ws(websocket: WebSocket, delivery_boy_id: str):
+async def delivery_boy_ws(websocket: WebSocket, delivery_boy_id: str, token: Optional[str] = Query(None)):
     await websocket.accept()
-    active_connections[delivery_boy_id] = websocket
+    if not await authenticate_partner_socket(websocket, delivery_boy_id, token):
+        print(f"[DEBUG] Rejected unauthenticated socket for delivery boy {delivery_boy_id}")
+        await websocket.close(code=1008)  # policy violation
+        return
+    await broker.register(delivery_boy_id, websocket)
     print(f"[DEBUG] Delivery boy {delivery_boy_id} connected")
 
-    # Mark online in DB
-    await delivery_user.update_one(
+    # Mark online in DB and in the in-memory dispatch index
+    partner = await delivery_user.find_one_and_update(
         {"_id": ObjectId(delivery_boy_id)},
-        {"$set": {"status": True, "last_update": datetime.utcnow()}}
+        {"$set": {"status": True, "last_update": datetime.utcnow()}},
+        projection={"name": 1, "location": 1},
+        return_document=ReturnDocument.AFTER
     )
+    invalidate_principal("delivery", delivery_boy_id)
+    if partner:
+        partner_index.set_online(
+            delivery_boy_id,
+            name=partner.get("name"),
+            coordinates=(partner.get("location") or {}).get("coordinates")
+        )
 
     try:
         while True:
             data = await websocket.receive_json()
+            broker.touch(delivery_boy_id)
+
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ping":
+                await broker.send(delivery_boy_id, {"type": "pong"})
+                continue
+            if data.get("type") == "location":
+                # {"type": "location", "latitude": .., "longitude": ..}; buffered, flushed in bulk
+                await record_location(delivery_boy_id, data.get("longitude"), data.get("latitude"))
+                continue
+
             print(f"[DEBUG] Received from {delivery_boy_id}: {data}")
 
             if data.get("type") == "order_response":
                 order_id = data.get("order_id")
                 response = data.get("response")  # "accept" or "reject"
 
-                # Store response
-                if order_id not in delivery_responses:
-                    delivery_responses[order_id] = {"event": asyncio.Event()}
-
-                delivery_responses[order_id][delivery_boy_id] = response
-                # Notify the assign_order task
-                delivery_responses[order_id]["event"].set()
+                # Hand the reply to the assign_order task waiting on this offer,
+                # which may be running on another worker
+                live = await broker.reply(order_id, delivery_boy_id, response)
 
-                # Send confirmation back to delivery boy
-                await websocket.send_json({
+                # Send confirmation back to delivery boy (through its send queue,
+                # never concurrently with the writer task)
+                await broker.send(delivery_boy_id, {
                     "type": "order_status",
                     "order_id": order_id,
-                    "status": response
+                    "status": response if live else "expired"
                 })
 
     except WebSocketDisconnect:
         print(f"[DEBUG] Delivery boy {delivery_boy_id} disconnected")
-        if delivery_boy_id in active_connections:
-            del active_connections[delivery_boy_id]
-        # Mark offline
-        await delivery_user.update_one(
-            {"_id": ObjectId(delivery_boy_id)},
-            {"$set": {"status": False, "last_update": datetime.utcnow()}}
-        )
+    finally:
+        # Already handled if the broker evicted this socket or the partner reconnected
+        if await broker.unregister(delivery_boy_id, websocket):
+            await mark_partner_offline(delivery_boy_id)
 
 food_styles = [
     "Andhra Style",
@@ -1209,14 +1058,21 @@ def get_food_styles():
 
 #user order track----------#
 @router.get("/orders/me")
-async def get_user_orders(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "user":
+async def get_user_orders(
+    cursor: Optional[str] = Query(None, description="Continuation token from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE, description="Maximum number of results to return"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.role != "user":
         raise HTTPException(status_code=403, detail="Only users can access this endpoint")
 
-    user_id = str(current_user["_id"])
+    user_id = current_user.id
 
-    # Fetch all orders for the user
-    orders = await db["orders"].find({"user_id": user_id}).sort("created_at", -1).to_list(length=None)
+    # One page of orders for the user, newest first; chef details are snapshotted on the order
+    orders, next_cursor = await paginate(
+        db["orders"], {"user_id": user_id}, cursor, limit,
+        projection={**LISTING_EXCLUDE, "customer_summary": 0}
+    )
 
     current_orders = []
     past_orders = []
@@ -1226,12 +1082,12 @@ async def get_user_orders(current_user: dict = Depends(get_current_user)):
         order["user_id"] = str(order["user_id"])
         order["delivery_boy_id"] = str(order.get("delivery_boy_id", ""))
 
-        # Fetch chef info
-        chef = await db["chef_user"].find_one({"_id": ObjectId(order["chef_id"])})
+        # Chef info
+        chef = order.pop("chef_summary", None) or {}
         order["chef"] = {
-            "name": chef.get("name") if chef else "Unknown",
-            "profile_pic": chef.get("photo_url") if chef else None,
-            "location": chef.get("location") if chef else None
+            "name": chef.get("name") or "Unknown",
+            "profile_pic": chef.get("profile_pic"),
+            "location": chef.get("location")
         }
 
         # Categorize based on order_status
@@ -1244,18 +1100,19 @@ async def get_user_orders(current_user: dict = Depends(get_current_user)):
     return {
         "status": "success",
         "current_orders": current_orders,
-        "past_orders": past_orders
+        "past_orders": past_orders,
+        "next_cursor": next_cursor
     }
 
 
 
 # Track individual order by order ID
 @router.get("/orders/me/{order_id}")
-async def track_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != "user":
+async def track_order(order_id: str, current_user: Principal = Depends(get_current_principal)):
+    if current_user.role != "user":
         raise HTTPException(status_code=403, detail="Only users can access this endpoint")
 
-    user_id = str(current_user["_id"])
+    user_id = current_user.id
 
     # Fetch the specific order for this user
     order = await db["orders"].find_one({"_id": ObjectId(order_id), "user_id": user_id})
@@ -1282,9 +1139,21 @@ async def track_order(order_id: str, current_user: dict = Depends(get_current_us
     order["delivery_boy_name"] = delivery_boy.get("name") if delivery_boy else "Not assigned"
     order["delivery_boy_location"] = delivery_boy.get("location") if delivery_boy else None
 
-    # Convert item IDs
-    for item in order.get("items", []):
-        item["food_id"] = str(item["food_id"])
-        item["chef_id"] = str(item["chef_id"])
+    return {"status": "success", "order": order}
+
 
-    return {"status": "success", "order": order}
\ No newline at end of file
+#-------------------- Order event stream -------------------------#
+# Server-sent events replacing polling of the order endpoints. Fetch the
+# order once, then apply the deltas; on a "resync" event (or reconnect)
+# fetch it again. Users, chefs and riders all use this endpoint.
+@router.get("/orders/events")
+async def order_event_stream(
+    order_id: Optional[str] = Query(None, description="Only stream updates for this order"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    sub = order_events.subscribe(current_user.role, current_user.id, order_id)
+    return StreamingResponse(
+        stream_order_events(sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,91 @@
+# scripts/check_broker_bus.py
+# End-to-end check of the mongo connection broker: two MongoBrokers in one
+# process act as two workers sharing the database configured in database.py.
+# Run from the repo root: python -m scripts.check_broker_bus
+import asyncio
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from database import db
+from services.broker import MongoBroker, PRESENCE_COLLECTION, PRESENCE_TTL, WORKER_ID
+
+TIMEOUT = 10
+
+
+class FakePartnerSocket:
+    """Stands in for a partner's websocket: records what the broker sends."""
+
+    def __init__(self):
+        self.received = asyncio.Queue()
+
+    async def send_json(self, message: dict):
+        await self.received.put(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def check(failures: list, label: str, ok: bool):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        failures.append(label)
+
+
+async def next_or_none(queue: asyncio.Queue):
+    try:
+        return await asyncio.wait_for(queue.get(), TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def run() -> list:
+    """A partner connects to worker B; worker A forwards an offer to it and
+    gets the partner's reply back over the bus. Then the presence doc is aged
+    past PRESENCE_TTL, as if B had crashed, and A must count the partner as
+    offline. Returns the failed checks."""
+    a = MongoBroker(f"{WORKER_ID}-check-a")
+    b = MongoBroker(f"{WORKER_ID}-check-b")
+    replies = asyncio.Queue()
+    a.on_reply = lambda order_id, partner_id, response: replies.put_nowait((order_id, partner_id, response)) or True
+    await a.start()
+    await b.start()
+
+    failures = []
+    partner_id = f"check-{uuid.uuid4().hex}"
+    order_id = f"check-order-{uuid.uuid4().hex}"
+    partner_socket = FakePartnerSocket()
+    await b.register(partner_id, partner_socket)
+    try:
+        check(failures, "partner on B is online for A", await a.online([partner_id]) == {partner_id})
+
+        offer = {"type": "order_request", "order_id": order_id}
+        check(failures, "A forwards the offer", await a.send(partner_id, offer))
+        check(failures, "offer reaches the partner on B", await next_or_none(partner_socket.received) == offer)
+
+        check(failures, "B forwards the reply", await b.reply(order_id, partner_id, "accept"))
+        check(failures, "reply reaches A", await next_or_none(replies) == (order_id, partner_id, "accept"))
+
+        await db[PRESENCE_COLLECTION].update_one(
+            {"_id": partner_id},
+            {"$set": {"last_seen": datetime.utcnow() - timedelta(seconds=PRESENCE_TTL + 1)}}
+        )
+        check(failures, "stale partner is offline for A", await a.online([partner_id]) == set())
+        check(failures, "A sends nothing to a stale partner", not await a.send(partner_id, offer))
+    finally:
+        await b.unregister(partner_id, partner_socket)
+        await a.stop()
+        await b.stop()
+    return failures
+
+
+def main():
+    failures = asyncio.run(run())
+    if failures:
+        print(f"{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("Broker bus checks passed")
+
+
+if __name__ == "__main__":
+    main()
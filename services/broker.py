@@ -0,0 +1,403 @@
+# services/broker.py
+import asyncio
+import os
+import socket
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+# "local": partners must connect to the worker that dispatches their orders
+# (single uvicorn worker). "mongo": any number of workers share presence and
+# route messages to each other through a capped collection.
+CONNECTION_BROKER = os.getenv("CONNECTION_BROKER", "local")
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+BUS_COLLECTION = "partner_messages"
+PRESENCE_COLLECTION = "partner_connections"
+BROADCAST = "*"  # bus address every worker listens on
+BUS_SIZE_BYTES = 16 * 1024 * 1024
+BUS_RETRY_SECONDS = 1
+MAX_PENDING_REPLIES = 10000  # remote offers we may still have to answer
+
+# Liveness: the server pings every HEARTBEAT_INTERVAL seconds and evicts a
+# socket that has sent nothing (pong or otherwise) for HEARTBEAT_TIMEOUT.
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT_TIMEOUT = 45
+# Presence docs are refreshed by the owning worker's heartbeat; a worker that
+# dies stops refreshing, so its partners count as offline after PRESENCE_TTL
+# and the TTL index removes their docs soon after.
+PRESENCE_TTL = HEARTBEAT_TIMEOUT + HEARTBEAT_INTERVAL
+
+# Backpressure: each socket has its own bounded queue drained by a writer
+# task, so a stalled client never blocks dispatch. When the queue is full,
+# droppable messages are discarded; otherwise SLOW_CONSUMER_POLICY applies:
+# "close" evicts the client, "drop_oldest" discards its oldest queued message.
+SEND_QUEUE_SIZE = 64
+SEND_TIMEOUT = 10
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "close")
+DROPPABLE_TYPES = {"ping", "pong", "offer_cancelled"}
+
+
+class PartnerConnection:
+    """One partner socket with its send queue, writer task and liveness clock."""
+
+    def __init__(self, partner_id: str, websocket):
+        self.partner_id = partner_id
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.last_seen = asyncio.get_running_loop().time()
+        self.handler = asyncio.current_task()  # the websocket endpoint's receive loop
+        self.writer = None
+
+    def touch(self):
+        self.last_seen = asyncio.get_running_loop().time()
+
+
+def _cancel_unless_current(task):
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+
+
+class LocalBroker:
+    """Delivery partner sockets held by this process.
+
+    Dispatch talks to partners only through the broker: `send` for
+    order_request / order_status messages, `reply` for the partner's answer.
+    `on_reply(order_id, partner_id, response)` and the coroutine
+    `on_lost(partner_id)` are set by the dispatcher; `on_lost` runs when a
+    socket is evicted for missing heartbeats, a failed send or a slow reader.
+    `publish` broadcasts an order event to `on_event` on every worker.
+    """
+
+    local_only = True
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.sockets = {}  # delivery_boy_id -> PartnerConnection
+        self.on_reply = lambda order_id, partner_id, response: False
+        self.on_lost = None
+        self.on_event = lambda event: None
+        self._heartbeat_task = None
+        self.counters = {
+            "sent_local": 0, "send_failures": 0, "dropped": 0,
+            "evicted_heartbeat": 0, "evicted_send_failed": 0, "evicted_slow": 0,
+        }
+
+    async def start(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        """Cancel the background tasks; sockets are left to their endpoints."""
+        _cancel_unless_current(self._heartbeat_task)
+        self._heartbeat_task = None
+
+    async def register(self, partner_id: str, websocket) -> PartnerConnection:
+        """Call from the websocket endpoint task, after accept()."""
+        previous = self.sockets.get(partner_id)
+        if previous is not None:
+            _cancel_unless_current(previous.writer)
+
+        conn = PartnerConnection(partner_id, websocket)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.sockets[partner_id] = conn
+        return conn
+
+    async def unregister(self, partner_id: str, websocket) -> bool:
+        """Forget the socket; False if it was already evicted or replaced."""
+        conn = self.sockets.get(partner_id)
+        if conn is None or conn.websocket is not websocket:
+            return False
+        del self.sockets[partner_id]
+        _cancel_unless_current(conn.writer)
+        return True
+
+    def touch(self, partner_id: str):
+        """Record that the partner is alive (any frame received counts)."""
+        conn = self.sockets.get(partner_id)
+        if conn is not None:
+            conn.touch()
+
+    async def evict(self, conn: PartnerConnection, reason: str, counter: str):
+        if not await self.unregister(conn.partner_id, conn.websocket):
+            return
+        print(f"[DEBUG] Evicting delivery boy {conn.partner_id}: {reason}")
+        self.counters[counter] += 1
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=1011), timeout=1)
+        except Exception:
+            pass  # half-open socket, nothing to tell the client
+        if self.on_lost is not None:
+            await self.on_lost(conn.partner_id)
+        # the receive loop may be stuck on a half-open socket forever
+        _cancel_unless_current(conn.handler)
+
+    def is_local(self, partner_id: str) -> bool:
+        return partner_id in self.sockets
+
+    async def online(self, partner_ids) -> set:
+        """The subset of partner_ids that currently have a socket on any worker."""
+        return {partner_id for partner_id in partner_ids if partner_id in self.sockets}
+
+    def _enqueue(self, conn: PartnerConnection, message: dict) -> bool:
+        try:
+            conn.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.counters["dropped"] += 1
+        if message.get("type") in DROPPABLE_TYPES:
+            return False
+        if SLOW_CONSUMER_POLICY == "drop_oldest":
+            conn.queue.get_nowait()
+            conn.queue.put_nowait(message)
+            return True
+        asyncio.create_task(self.evict(conn, "send queue full", "evicted_slow"))
+        return False
+
+    async def _writer(self, conn: PartnerConnection):
+        while True:
+            message = await conn.queue.get()
+            try:
+                await asyncio.wait_for(conn.websocket.send_json(message), timeout=SEND_TIMEOUT)
+                self.counters["sent_local"] += 1
+            except Exception as e:
+                print(f"[DEBUG] Send to delivery boy {conn.partner_id} failed: {e!r}")
+                self.counters["send_failures"] += 1
+                await self.evict(conn, "send failed", "evicted_send_failed")
+                return
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = asyncio.get_running_loop().time()
+            stale = []
+            for conn in list(self.sockets.values()):
+                if now - conn.last_seen > HEARTBEAT_TIMEOUT:
+                    stale.append(conn)
+                else:
+                    self._enqueue(conn, {"type": "ping"})
+            await asyncio.gather(*(
+                self.evict(conn, f"no frames for {now - conn.last_seen:.0f}s", "evicted_heartbeat")
+                for conn in stale
+            ))
+            try:
+                await self._refresh_presence()
+            except Exception as e:
+                print(f"[BROKER] Presence refresh failed: {e}")
+
+    async def _refresh_presence(self):
+        """Tell the other workers this worker's sockets are still alive."""
+
+    async def _send_local(self, partner_id: str, message: dict) -> bool:
+        conn = self.sockets.get(partner_id)
+        if conn is None:
+            return False
+        return self._enqueue(conn, message)
+
+    async def send(self, partner_id: str, message: dict) -> bool:
+        return await self._send_local(partner_id, message)
+
+    async def reply(self, order_id: str, partner_id: str, response: str) -> bool:
+        """Route a partner's answer to the dispatcher that made the offer."""
+        return self.on_reply(order_id, partner_id, response)
+
+    async def publish(self, event: dict):
+        self.on_event(event)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "worker": self.worker_id,
+            "local_connections": len(self.sockets),
+            "queued_messages": sum(conn.queue.qsize() for conn in self.sockets.values()),
+            **self.counters,
+        }
+
+
+class MongoBroker(LocalBroker):
+    """Cross-worker broker: presence in Mongo, messages over a capped collection.
+
+    Each worker tails the bus for documents addressed to it. A partner's
+    socket lives on exactly one worker (recorded in PRESENCE_COLLECTION);
+    offers for it are forwarded there, and its reply is forwarded back to
+    the worker whose dispatcher is waiting. Order events are broadcast to
+    every worker.
+    """
+
+    local_only = False
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        super().__init__(worker_id)
+        self._reply_to = OrderedDict()  # (order_id, partner_id) -> origin worker
+        self._tail_task = None
+        self.counters.update({"forwarded": 0, "received": 0, "replies_forwarded": 0})
+
+    @property
+    def _bus(self):
+        from database import db
+        return db[BUS_COLLECTION]
+
+    @property
+    def _presence(self):
+        from database import db
+        return db[PRESENCE_COLLECTION]
+
+    async def start(self):
+        from database import db
+        await super().start()
+        try:
+            await db.create_collection(BUS_COLLECTION, capped=True, size=BUS_SIZE_BYTES)
+        except CollectionInvalid:
+            pass  # another worker created it
+        if self._tail_task is None:
+            # everything already on the bus is history; tail from its last document
+            last = await self._bus.find_one(self._bus_filter(), {"_id": 1}, sort=[("$natural", -1)])
+            self._tail_task = asyncio.create_task(self._tail(last["_id"] if last else None))
+
+    async def stop(self):
+        await super().stop()
+        _cancel_unless_current(self._tail_task)
+        self._tail_task = None
+
+    async def register(self, partner_id: str, websocket) -> PartnerConnection:
+        conn = await super().register(partner_id, websocket)
+        await self._presence.update_one(
+            {"_id": partner_id},
+            {"$set": {"worker": self.worker_id, "connected_at": datetime.utcnow(), "last_seen": datetime.utcnow()}},
+            upsert=True
+        )
+        return conn
+
+    async def unregister(self, partner_id: str, websocket) -> bool:
+        if not await super().unregister(partner_id, websocket):
+            return False
+        # only clear presence if the partner has not reconnected elsewhere
+        await self._presence.delete_one({"_id": partner_id, "worker": self.worker_id})
+        return True
+
+    async def _refresh_presence(self):
+        if self.sockets:
+            await self._presence.update_many(
+                {"_id": {"$in": list(self.sockets)}, "worker": self.worker_id},
+                {"$set": {"last_seen": datetime.utcnow()}}
+            )
+
+    def _live(self) -> dict:
+        """Presence filter: refreshed by a worker heartbeat within PRESENCE_TTL."""
+        return {"last_seen": {"$gte": datetime.utcnow() - timedelta(seconds=PRESENCE_TTL)}}
+
+    async def online(self, partner_ids) -> set:
+        partner_ids = list(partner_ids)
+        local = {partner_id for partner_id in partner_ids if partner_id in self.sockets}
+        remote = [partner_id for partner_id in partner_ids if partner_id not in local]
+        if remote:
+            async for doc in self._presence.find({"_id": {"$in": remote}, **self._live()}, {"_id": 1}):
+                local.add(doc["_id"])
+        return local
+
+    async def send(self, partner_id: str, message: dict) -> bool:
+        if partner_id in self.sockets:
+            return await self._send_local(partner_id, message)
+
+        presence = await self._presence.find_one({"_id": partner_id, **self._live()}, {"worker": 1})
+        if not presence or presence["worker"] == self.worker_id:
+            return False
+        await self._bus.insert_one({
+            "worker": presence["worker"],
+            "kind": "send",
+            "partner_id": partner_id,
+            "message": message,
+            "origin": self.worker_id,
+        })
+        self.counters["forwarded"] += 1
+        return True
+
+    async def reply(self, order_id: str, partner_id: str, response: str) -> bool:
+        origin = self._reply_to.pop((order_id, partner_id), None)
+        if origin is None or origin == self.worker_id:
+            return self.on_reply(order_id, partner_id, response)
+        await self._bus.insert_one({
+            "worker": origin,
+            "kind": "reply",
+            "order_id": order_id,
+            "partner_id": partner_id,
+            "response": response,
+        })
+        self.counters["replies_forwarded"] += 1
+        return True
+
+    async def publish(self, event: dict):
+        # delivered to this worker too, through its own tail
+        await self._bus.insert_one({"worker": BROADCAST, "kind": "event", "event": event})
+
+    def _remember_origin(self, doc: dict):
+        message = doc["message"]
+        key = (message.get("order_id"), doc["partner_id"])
+        if message.get("type") == "order_request":
+            self._reply_to[key] = doc["origin"]
+            self._reply_to.move_to_end(key)
+            while len(self._reply_to) > MAX_PENDING_REPLIES:
+                self._reply_to.popitem(last=False)
+        elif message.get("type") in ("offer_cancelled", "order_status"):
+            self._reply_to.pop(key, None)
+
+    async def _handle(self, doc: dict):
+        self.counters["received"] += 1
+        if doc["kind"] == "send":
+            self._remember_origin(doc)
+            await self._send_local(doc["partner_id"], doc["message"])
+        elif doc["kind"] == "reply":
+            self.on_reply(doc["order_id"], doc["partner_id"], doc["response"])
+        elif doc["kind"] == "event":
+            self.on_event(doc["event"])
+
+    def _bus_filter(self) -> dict:
+        return {"worker": {"$in": [self.worker_id, BROADCAST]}}
+
+    async def _tail(self, last_id):
+        """Handle bus documents after `last_id`, in the capped collection's natural order.
+
+        Natural order is the server's insertion order, the same for every
+        worker. _id values are minted by each client's clock, so a cutoff on
+        _id would drop documents from a worker whose clock runs behind.
+        """
+        while True:
+            try:
+                if last_id is not None and not await self._bus.find_one({"_id": last_id}, {"_id": 1}):
+                    last_id = None  # overwritten by the capped collection: what is left is all newer
+                cursor = self._bus.find(self._bus_filter(), cursor_type=CursorType.TAILABLE_AWAIT)
+                skipping = last_id is not None
+                while cursor.alive:
+                    async for doc in cursor:
+                        if skipping:
+                            skipping = doc["_id"] != last_id
+                            continue
+                        last_id = doc["_id"]
+                        await self._handle(doc)
+            except Exception as e:
+                print(f"[BROKER] Bus tail failed: {e}")
+            # a tailable cursor dies on an empty collection; retry
+            await asyncio.sleep(BUS_RETRY_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "backend": "mongo",
+            "pending_remote_offers": len(self._reply_to),
+        }
+
+
+def make_broker(name: str = CONNECTION_BROKER) -> LocalBroker:
+    if name == "mongo":
+        return MongoBroker()
+    if name != "local":
+        print(f"[BROKER] Unknown CONNECTION_BROKER {name!r}, using local")
+    return LocalBroker()
+
+
+broker = make_broker()
+
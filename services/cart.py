@@ -0,0 +1,88 @@
+# services/cart.py
+from datetime import datetime
+from pymongo import ReturnDocument
+from database import db
+
+
+def cart_line(food_item: dict, quantity: int) -> dict:
+    return {
+        "food_id": str(food_item["_id"]),
+        "chef_id": str(food_item["chef_id"]),
+        "food_name": food_item["food_name"],
+        "quantity": quantity,
+        "price": food_item["price"],
+        "photo_url": food_item.get("photo_url"),
+    }
+
+
+def _cart_pipeline(deltas: dict, quantities: dict, new_lines: list) -> list:
+    """Aggregation-pipeline update applying all line changes in one atomic write.
+
+    deltas:     food_id -> amount added to the line's quantity
+    quantities: food_id -> absolute quantity
+    new_lines:  lines appended when their food_id is not in the cart yet
+    Lines whose quantity drops to 0 or below are removed and total_price is
+    recomputed from the remaining lines. Values from the request go through
+    $literal so they can never be read as field paths or operators.
+    """
+    branches = [
+        {"case": {"$eq": ["$$line.food_id", {"$literal": food_id}]},
+         "then": {"$add": ["$$line.quantity", {"$literal": amount}]}}
+        for food_id, amount in deltas.items()
+    ] + [
+        {"case": {"$eq": ["$$line.food_id", {"$literal": food_id}]},
+         "then": {"$literal": quantity}}
+        for food_id, quantity in quantities.items()
+    ]
+    new_quantity = {"$switch": {"branches": branches, "default": "$$line.quantity"}} if branches else "$$line.quantity"
+
+    return [
+        {"$set": {"items": {"$let": {
+            "vars": {"current": {"$ifNull": ["$items", []]}},
+            "in": {"$concatArrays": [
+                {"$map": {
+                    "input": "$$current",
+                    "as": "line",
+                    "in": {"$mergeObjects": ["$$line", {"quantity": new_quantity}]},
+                }},
+                {"$filter": {
+                    "input": {"$literal": new_lines},
+                    "as": "new",
+                    "cond": {"$not": [{"$in": ["$$new.food_id", "$$current.food_id"]}]},
+                }},
+            ]},
+        }}}},
+        {"$set": {"items": {"$filter": {"input": "$items", "as": "line", "cond": {"$gt": ["$$line.quantity", 0]}}}}},
+        {"$set": {
+            "total_price": {"$sum": {"$map": {
+                "input": "$items", "as": "line", "in": {"$multiply": ["$$line.price", "$$line.quantity"]},
+            }}},
+            "last_update": {"$literal": datetime.utcnow()},
+        }},
+    ]
+
+
+async def update_cart(user_id: str, deltas: dict = None, quantities: dict = None,
+                      new_lines: list = None, require_item: str = None):
+    """Apply cart line changes atomically and return the updated cart.
+
+    Creates the cart when it does not exist, unless `require_item` is given,
+    in which case the write only happens if that food_id is in the cart
+    (returns None otherwise). A cart left with no lines is deleted; the empty
+    cart is still returned so callers can tell.
+    """
+    query = {"user_id": user_id}
+    if require_item:
+        query["items.food_id"] = require_item
+
+    cart = await db["carts"].find_one_and_update(
+        query,
+        _cart_pipeline(deltas or {}, quantities or {}, new_lines or []),
+        upsert=not require_item,
+        return_document=ReturnDocument.AFTER
+    )
+
+    if cart is not None and not cart.get("items"):
+        # conditional, so a line added concurrently is not thrown away
+        await db["carts"].delete_one({"_id": cart["_id"], "items": {"$size": 0}})
+    return cart
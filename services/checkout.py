@@ -0,0 +1,168 @@
+# services/checkout.py
+import asyncio
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from database import client, db
+from services.items import get_items_metadata
+from services.order_summary import summarize, profile_projection
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+_NO_TRANSACTIONS = 20  # IllegalOperation: standalone mongod, no replica set
+
+# Seconds per checkout step, for the most recent checkouts
+CHECKOUT_STEPS = ("load", "price", "write", "total")
+_step_latencies = {step: deque(maxlen=2000) for step in CHECKOUT_STEPS}
+_checkout_counters = {"created": 0, "replayed": 0, "conflicts": 0, "non_transactional": 0}
+_transactions_supported = True
+
+
+@contextmanager
+def _timed(step: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _step_latencies[step].append(time.perf_counter() - started)
+
+
+class _CartChanged(Exception):
+    pass
+
+
+async def _existing_order(user_id: str, idempotency_key: str):
+    if not idempotency_key:
+        return None
+    order = await db["orders"].find_one({"user_id": user_id, "idempotency_key": idempotency_key})
+    if order:
+        order["_id"] = str(order["_id"])
+    return order
+
+
+async def _write_order(order: dict, cart: dict, session=None):
+    """Insert the order and delete the cart it was built from, unless the cart changed meanwhile."""
+    result = await db["orders"].insert_one(order, session=session)
+    deleted = await db["carts"].delete_one(
+        {"_id": cart["_id"], "last_update": cart.get("last_update")}, session=session
+    )
+    if deleted.deleted_count == 0:
+        if session is None:
+            await db["orders"].delete_one({"_id": result.inserted_id})
+        raise _CartChanged()
+    return result.inserted_id
+
+
+async def _commit(order: dict, cart: dict):
+    global _transactions_supported
+    if _transactions_supported:
+        try:
+            async with await client.start_session() as session:
+                # with_transaction retries on transient errors and unknown commit results
+                return await session.with_transaction(lambda s: _write_order(dict(order), cart, s))
+        except OperationFailure as e:
+            if e.code != _NO_TRANSACTIONS:
+                raise
+            print("[DEBUG] Mongo transactions unavailable (no replica set); checkout falls back to compensating writes")
+            _transactions_supported = False
+
+    _checkout_counters["non_transactional"] += 1
+    return await _write_order(order, cart)
+
+
+async def place_order(user_id: str, idempotency_key: str = None, customer: dict = None) -> tuple:
+    """Turn the user's cart into an order. Returns (order, replayed).
+
+    The order insert and the cart delete commit together in one transaction,
+    and only if the cart is unchanged since it was read. With an idempotency
+    key, a retried request returns the order created by the first attempt.
+    `customer` is the user's profile, snapshotted onto the order for listings.
+    """
+    if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency key too long")
+
+    started = time.perf_counter()
+    try:
+        with _timed("load"):
+            previous, cart, address = await asyncio.gather(
+                _existing_order(user_id, idempotency_key),
+                db["carts"].find_one({"user_id": user_id}),
+                db["addresses"].find_one({"user_id": user_id, "is_default": True}),
+            )
+        if previous:
+            _checkout_counters["replayed"] += 1
+            return previous, True
+
+        if not cart or not cart.get("items"):
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        if not address:
+            raise HTTPException(status_code=404, detail="No default address found")
+
+        # Convert ObjectId to string
+        address["_id"] = str(address["_id"])
+
+        chef_id = cart["items"][0]["chef_id"]  # assume same chef for all items
+
+        with _timed("price"):
+            # Charge current prices; items deleted since they were added cannot be ordered
+            food_items, chef = await asyncio.gather(
+                get_items_metadata(line["food_id"] for line in cart["items"]),
+                db["chef_user"].find_one({"_id": ObjectId(chef_id)}, profile_projection("chef")),
+            )
+        unavailable = [line["food_name"] for line in cart["items"] if line["food_id"] not in food_items]
+        if unavailable:
+            raise HTTPException(status_code=409, detail=f"No longer available: {unavailable}")
+        items = [{**line, "price": food_items[line["food_id"]]["price"]} for line in cart["items"]]
+
+        order = {
+            "user_id": user_id,
+            "chef_id": chef_id,
+            "items": items,
+            "total_price": sum(line["price"] * line["quantity"] for line in items),
+            "address": address,          # include the default address
+            "status": "pending",
+            "chef_status": "pending",
+            "delivery_status": "pending",
+            "created_at": datetime.utcnow(),
+            # what listing screens show, so they need no joins
+            "chef_summary": summarize("chef", chef),
+            "customer_summary": summarize("user", customer),
+        }
+        if idempotency_key:
+            order["idempotency_key"] = idempotency_key
+
+        with _timed("write"):
+            try:
+                order_id = await _commit(order, cart)
+            except DuplicateKeyError:
+                # a concurrent retry with the same key won the race
+                _checkout_counters["replayed"] += 1
+                return await _existing_order(user_id, idempotency_key), True
+            except _CartChanged:
+                _checkout_counters["conflicts"] += 1
+                raise HTTPException(status_code=409, detail="Cart changed during checkout, please retry")
+
+        order["_id"] = str(order_id)
+        _checkout_counters["created"] += 1
+        return order, False
+    finally:
+        _step_latencies["total"].append(time.perf_counter() - started)
+
+
+def checkout_stats() -> dict:
+    steps = {}
+    for step, samples in _step_latencies.items():
+        samples = sorted(samples)
+        if not samples:
+            steps[step] = None
+            continue
+        steps[step] = {
+            "count": len(samples),
+            "p50_ms": round(statistics.median(samples) * 1000, 2),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+        }
+    return {**_checkout_counters, "transactions": _transactions_supported, "latency": steps}
@@ -0,0 +1,321 @@
+# services/dispatch.py
+import asyncio
+import statistics
+import time
+from collections import deque
+from datetime import datetime
+from bson import ObjectId
+from database import db
+from services.distance import distances_from
+from services.partners import partner_index
+from services.broker import broker
+from services.order_events import publish_order_event
+from services.locations import rider_orders
+from services.order_summary import summarize, profile_projection
+from auth.jwt_handler import invalidate_principal
+
+# Offer an order to the WAVE_SIZE nearest online partners at once, for up to
+# DISPATCH_WAVES waves, waiting BACKOFF * 2**wave seconds between waves.
+DISPATCH_WAVE_SIZE = 3
+DISPATCH_WAVES = 3
+DISPATCH_OFFER_TIMEOUT = 30      # seconds each wave waits for an accept
+DISPATCH_BACKOFF_SECONDS = 5
+DISPATCH_CANDIDATES = 20         # nearest partners considered per wave
+MAX_OUTSTANDING_OFFERS = 10000   # hard cap on offers awaiting a reply, per process
+
+class OfferRegistry:
+    """Outstanding order offers, one future per (order_id, delivery_boy_id).
+
+    Every entry is removed as soon as it is answered, cancelled, timed out or
+    its partner disconnects, so the registry only ever holds live offers.
+    """
+
+    def __init__(self, max_outstanding: int = MAX_OUTSTANDING_OFFERS):
+        self.max_outstanding = max_outstanding
+        self._offers = {}      # (order_id, delivery_boy_id) -> Future
+        self._by_partner = {}  # delivery_boy_id -> set of order_ids
+        self.counters = {"opened": 0, "answered": 0, "expired": 0, "refused_full": 0, "stray_replies": 0}
+
+    def __len__(self):
+        return len(self._offers)
+
+    def open(self, order_id: str, delivery_boy_id: str):
+        """Register an offer and return the future its reply will resolve, or None when full."""
+        key = (order_id, delivery_boy_id)
+        if key in self._offers:
+            return self._offers[key]
+        if len(self._offers) >= self.max_outstanding:
+            self.counters["refused_full"] += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._offers[key] = future
+        self._by_partner.setdefault(delivery_boy_id, set()).add(order_id)
+        self.counters["opened"] += 1
+        return future
+
+    def _remove(self, order_id: str, delivery_boy_id: str):
+        future = self._offers.pop((order_id, delivery_boy_id), None)
+        orders = self._by_partner.get(delivery_boy_id)
+        if orders is not None:
+            orders.discard(order_id)
+            if not orders:
+                del self._by_partner[delivery_boy_id]
+        return future
+
+    def resolve(self, order_id: str, delivery_boy_id: str, response: str) -> bool:
+        """Deliver a partner's reply; False if there is no live offer for it."""
+        future = self._remove(order_id, delivery_boy_id)
+        if future is None or future.done():
+            self.counters["stray_replies"] += 1
+            return False
+        future.set_result(response)
+        self.counters["answered"] += 1
+        return True
+
+    def close(self, order_id: str, delivery_boy_id: str):
+        """Forget an offer that timed out or was cancelled."""
+        future = self._remove(order_id, delivery_boy_id)
+        if future is not None and not future.done():
+            future.cancel()
+            self.counters["expired"] += 1
+
+    def drop_partner(self, delivery_boy_id: str):
+        """Fail every offer still waiting on a partner whose socket went away."""
+        for order_id in list(self._by_partner.get(delivery_boy_id, ())):
+            future = self._remove(order_id, delivery_boy_id)
+            if future is not None and not future.done():
+                future.set_result("disconnected")
+
+    def stats(self) -> dict:
+        return {
+            "outstanding": len(self._offers),
+            "partners_with_offers": len(self._by_partner),
+            "max_outstanding": self.max_outstanding,
+            **self.counters,
+        }
+
+
+offer_registry = OfferRegistry()
+
+
+async def mark_partner_offline(delivery_boy_id: str):
+    """A partner's socket is gone: stop offering to it and flag it offline."""
+    partner_index.set_offline(delivery_boy_id)
+    offer_registry.drop_partner(delivery_boy_id)
+    await db["delivery_user"].update_one(
+        {"_id": ObjectId(delivery_boy_id)},
+        {"$set": {"status": False, "last_update": datetime.utcnow()}}
+    )
+    invalidate_principal("delivery", delivery_boy_id)
+
+
+# Partner replies (local or forwarded from another worker) resolve our offers;
+# sockets evicted by the broker (dead, stalled) are taken offline
+broker.on_reply = offer_registry.resolve
+broker.on_lost = mark_partner_offline
+
+# Seconds from dispatch start to assignment, for the most recent orders
+_assignment_latencies = deque(maxlen=1000)
+_dispatch_counters = {"dispatched": 0, "assigned": 0, "unassigned": 0, "offers_sent": 0}
+
+
+# ------------------------------
+# Find Nearby Delivery Boys
+# ------------------------------
+async def find_nearby_delivery_boys(chef_location: dict, max_distance: int = 5000, limit: int = None):
+    chef_lon, chef_lat = chef_location["coordinates"]
+
+    # Partners with a live socket on this worker are tracked in memory; with a
+    # cross-worker broker they may be connected anywhere, so ask Mongo
+    if broker.local_only and partner_index.online_count():
+        return partner_index.nearest(chef_lon, chef_lat, k=limit, max_distance=max_distance)
+
+    # Cold start: nobody has connected since the process started, ask Mongo
+    delivery_boys_cursor = db["delivery_user"].find({
+        "role": "delivery",
+        "status": True,  # must be online
+        "location": {
+            "$near": {
+                "$geometry": {"type": "Point", "coordinates": [chef_lon, chef_lat]},
+                "$maxDistance": max_distance
+            }
+        }
+    })
+
+    if limit:
+        delivery_boys_cursor = delivery_boys_cursor.limit(limit)
+    delivery_boys = await delivery_boys_cursor.to_list(length=limit)
+
+    # Distances for all candidates in one vectorized pass
+    distances = distances_from(
+        [chef_lon, chef_lat],
+        [boy["location"]["coordinates"] for boy in delivery_boys]
+    ).tolist()
+
+    return [
+        {
+            "id": str(delivery_boy["_id"]),
+            "name": delivery_boy.get("name"),
+            "location": delivery_boy.get("location"),
+            "distance_meters": round(distance, 2)
+        }
+        for delivery_boy, distance in zip(delivery_boys, distances)
+    ]
+
+
+# ------------------------------
+# Offer plumbing
+# ------------------------------
+async def send_to_partner(delivery_boy_id: str, message: dict) -> bool:
+    """Send a message to a partner on whichever worker holds its socket."""
+    return await broker.send(delivery_boy_id, message)
+
+
+async def _cancel_offers(order_id: str, delivery_boy_ids):
+    for boy_id in delivery_boy_ids:
+        offer_registry.close(order_id, boy_id)
+    await asyncio.gather(*(
+        send_to_partner(boy_id, {"type": "offer_cancelled", "order_id": order_id})
+        for boy_id in delivery_boy_ids
+    ))
+
+
+async def _claim_order(order_id: str, delivery_boy_id: str) -> bool:
+    """First accept wins: only assigns the order if nobody has claimed it yet."""
+    rider = await db["delivery_user"].find_one({"_id": ObjectId(delivery_boy_id)}, profile_projection("delivery"))
+    changes = {
+        "delivery_boy_id": delivery_boy_id,
+        "delivery_status": "assigned",
+        "accepted_at": datetime.utcnow(),
+    }
+    order = await db["orders"].find_one_and_update(
+        {"_id": ObjectId(order_id), "delivery_boy_id": None, "status": {"$ne": "cancelled"}},
+        {"$set": {**changes, "rider_summary": summarize("delivery", rider)}},
+        projection={"user_id": 1, "chef_id": 1}
+    )
+    if order is None:
+        return False
+    rider_orders.invalidate(delivery_boy_id)
+    await publish_order_event(order, changes)
+    return True
+
+
+async def _run_wave(order_id: str, delivery_boy_ids: list, timeout: float):
+    """Offer the order to every partner of the wave at once.
+
+    Returns (winner_id, claimed_elsewhere). The first partner whose accept
+    wins the atomic claim gets the order; every other outstanding offer is
+    cancelled.
+    """
+    # register before sending so an instant reply cannot be lost
+    futures = {}
+    for boy_id in delivery_boy_ids:
+        future = offer_registry.open(order_id, boy_id)
+        if future is None:
+            print(f"[DEBUG] Offer registry full, not offering order {order_id} to {boy_id}")
+            continue
+        futures[future] = boy_id
+
+    offer = {
+        "type": "order_request",
+        "order_id": order_id,
+        "message": "New delivery request assigned to you!"
+    }
+    boy_ids = list(futures.values())
+    sent = await asyncio.gather(*(send_to_partner(boy_id, offer) for boy_id in boy_ids))
+    failed = {boy_id for boy_id, ok in zip(boy_ids, sent) if not ok}
+    for boy_id in failed:
+        offer_registry.close(order_id, boy_id)
+
+    pending = {future for future, boy_id in futures.items() if boy_id not in failed}
+    answered = set(failed)
+    _dispatch_counters["offers_sent"] += len(pending)
+    print(f"[DEBUG] Offered order {order_id} to {sorted(futures[f] for f in pending)}")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+            for future in done:
+                boy_id = futures[future]
+                answered.add(boy_id)
+                response = None if future.cancelled() else future.result()
+                if response != "accept":
+                    print(f"[DEBUG] Delivery boy {boy_id} did not take order {order_id}: {response}")
+                    continue
+
+                if await _claim_order(order_id, boy_id):
+                    print(f"[DEBUG] Order {order_id} assigned to {boy_id}")
+                    await send_to_partner(boy_id, {"type": "order_status", "order_id": order_id, "status": "accepted"})
+                    return boy_id, False
+
+                # someone else (e.g. another worker) got there first
+                await send_to_partner(boy_id, {"type": "order_status", "order_id": order_id, "status": "taken"})
+                return None, True
+
+        if pending:
+            print(f"[DEBUG] Delivery boys {sorted(futures[f] for f in pending)} did not respond in {timeout}s")
+        return None, False
+    finally:
+        # timed out, or still open when another partner won
+        await _cancel_offers(order_id, [boy_id for boy_id in boy_ids if boy_id not in answered])
+
+
+# ------------------------------
+# Assign Order in parallel waves
+# ------------------------------
+async def assign_order(order_id: str, chef_location: dict, max_distance: int = 5000, timeout: int = DISPATCH_OFFER_TIMEOUT):
+    started = time.monotonic()
+    _dispatch_counters["dispatched"] += 1
+    offered = set()
+
+    for wave in range(DISPATCH_WAVES):
+        if wave:
+            await asyncio.sleep(DISPATCH_BACKOFF_SECONDS * 2 ** (wave - 1))
+
+        # re-rank every wave: partners move and come online
+        nearby_delivery_boys = await find_nearby_delivery_boys(chef_location, max_distance, DISPATCH_CANDIDATES)
+        candidates = [boy["id"] for boy in nearby_delivery_boys if boy["id"] not in offered]
+        connected = await broker.online(candidates)
+        wave_ids = [boy_id for boy_id in candidates if boy_id in connected][:DISPATCH_WAVE_SIZE]
+
+        if not wave_ids:
+            print(f"[DEBUG] No new delivery boys available for order {order_id} (wave {wave + 1})")
+            continue
+
+        offered.update(wave_ids)
+        winner, claimed_elsewhere = await _run_wave(order_id, wave_ids, timeout)
+        if winner:
+            _dispatch_counters["assigned"] += 1
+            _assignment_latencies.append(time.monotonic() - started)
+            return winner
+        if claimed_elsewhere:
+            return None
+
+    print(f"[DEBUG] No delivery boy accepted order {order_id}")
+    _dispatch_counters["unassigned"] += 1
+    await db["orders"].update_one(
+        {"_id": ObjectId(order_id), "delivery_boy_id": None},
+        {"$set": {"delivery_status": "unassigned"}}
+    )
+    return None
+
+
+def dispatch_stats() -> dict:
+    latencies = list(_assignment_latencies)
+    return {
+        **_dispatch_counters,
+        "median_time_to_assign_seconds": round(statistics.median(latencies), 3) if latencies else None,
+        "p90_time_to_assign_seconds": (
+            round(statistics.quantiles(latencies, n=10)[-1], 3) if len(latencies) >= 2 else None
+        ),
+        "connections": broker.stats(),
+        "offers": offer_registry.stats(),
+    }
@@ -0,0 +1,67 @@
+# services/distance.py
+import math
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+SCALAR_CUTOFF = 16
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """Scalar great-circle distance in metres, for one-off pairs."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_M * c
+
+
+def _as_lon_lat(points) -> tuple:
+    """Split [[lon, lat], ...] (or an (N, 2) array) into radian lon and lat arrays."""
+    arr = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    return arr[:, 0], arr[:, 1]
+
+
+def distances_from(origin, points) -> np.ndarray:
+    """Great-circle distance in metres from one [lon, lat] origin to N [lon, lat] points."""
+    if len(points) == 0:
+        return np.empty(0)
+    if len(points) < SCALAR_CUTOFF and not isinstance(points, np.ndarray):
+        # NumPy's fixed per-call overhead outweighs the win for a handful of points
+        return np.array([haversine(origin[0], origin[1], lon, lat) for lon, lat in points])
+    lon0, lat0 = np.radians(origin[0]), np.radians(origin[1])
+    lon, lat = _as_lon_lat(points)
+
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_matrix(origins, destinations) -> np.ndarray:
+    """(len(origins), len(destinations)) matrix of great-circle distances in metres."""
+    lon1, lat1 = _as_lon_lat(origins)
+    lon2, lat2 = _as_lon_lat(destinations)
+    lon1, lat1 = lon1[:, None], lat1[:, None]
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def sort_by_distance(origin, docs: list, coordinates_of) -> list:
+    """Attach `distance_meters` to every doc that has coordinates and sort nearest first.
+
+    `coordinates_of(doc)` returns [lon, lat] or None; docs without a position
+    keep their relative order at the end of the list.
+    """
+    located = [(doc, coordinates_of(doc)) for doc in docs]
+    with_position = [(doc, coords) for doc, coords in located if coords]
+    without_position = [doc for doc, coords in located if not coords]
+
+    distances = distances_from(origin, [coords for _, coords in with_position])
+    for (doc, _), distance in zip(with_position, distances):
+        doc["distance_meters"] = round(float(distance), 2)
+
+    order = np.argsort(distances, kind="stable")
+    return [with_position[i][0] for i in order] + without_position
@@ -0,0 +1,33 @@
+# services/enrichment.py
+from bson import ObjectId
+from database import db
+
+
+def _to_object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    if value and ObjectId.is_valid(str(value)):
+        return ObjectId(str(value))
+    return None
+
+
+async def fetch_docs_by_id(collection: str, ids, projection: dict = None) -> dict:
+    """Fetch every referenced document of `collection` with one $in query.
+
+    Returns a dict of str(_id) -> document so callers can join in memory
+    instead of running one find_one per row.
+    """
+    object_ids = {oid for oid in (_to_object_id(i) for i in ids) if oid is not None}
+    if not object_ids:
+        return {}
+
+    if projection is not None:
+        projection = {**projection, "_id": 1}
+
+    cursor = db[collection].find({"_id": {"$in": list(object_ids)}}, projection)
+    return {str(doc["_id"]): doc async for doc in cursor}
+
+
+async def fetch_related(orders: list, field: str, collection: str, projection: dict = None) -> dict:
+    """Batch-load the documents referenced by `field` across a list of orders."""
+    return await fetch_docs_by_id(collection, [o.get(field) for o in orders], projection)
@@ -0,0 +1,72 @@
+# services/facets.py
+import asyncio
+import re
+from pymongo import UpdateOne
+from database import db
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def facet_key(value) -> str:
+    """Normalize a catalog value so it can be matched exactly: " Non Veg " -> "non-veg"."""
+    if not value:
+        return ""
+    return "-".join(_NON_ALNUM.sub(" ", str(value).lower()).split())
+
+
+def food_style_key(value) -> str:
+    # "Andhra Style", "andhra style" and "Andhra" all map to "andhra"
+    key = facet_key(value)
+    if key.endswith("-style"):
+        key = key[: -len("-style")]
+    return key
+
+
+def service_type_key(value) -> str:
+    return facet_key(value)
+
+
+def food_type_key(value) -> str:
+    return facet_key(value)
+
+
+def facet_fields(food_style, service_type, food_type) -> dict:
+    """Facet keys stored on every food_items document next to the display values."""
+    return {
+        "food_style_key": food_style_key(food_style),
+        "service_type_key": service_type_key(service_type),
+        "food_type_key": food_type_key(food_type),
+    }
+
+
+async def backfill_facet_keys(batch_size: int = 500) -> int:
+    """Migration: add facet keys to food_items written before they existed."""
+    cursor = db["food_items"].find(
+        {"$or": [
+            {"food_style_key": {"$exists": False}},
+            {"service_type_key": {"$exists": False}},
+            {"food_type_key": {"$exists": False}},
+        ]},
+        {"food_style": 1, "service_type": 1, "food_type": 1},
+    )
+
+    updated = 0
+    batch = []
+    async for item in cursor:
+        keys = facet_fields(item.get("food_style"), item.get("service_type"), item.get("food_type"))
+        batch.append(UpdateOne({"_id": item["_id"]}, {"$set": keys}))
+        if len(batch) >= batch_size:
+            result = await db["food_items"].bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+
+    if batch:
+        result = await db["food_items"].bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    return updated
+
+
+if __name__ == "__main__":
+    # python -m services.facets
+    print(f"Backfilled facet keys on {asyncio.run(backfill_facet_keys())} food items")
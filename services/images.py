@@ -0,0 +1,163 @@
+# services/images.py
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from database import db
+
+# Longest edge in pixels per variant; every variant is written as WebP and JPEG
+IMAGE_VARIANTS = {"large": 1280, "medium": 640, "thumb": 200}
+IMAGE_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}),
+                 "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+MAX_IMAGE_PIXELS = 50_000_000  # refuse decompression bombs
+
+_pool = None
+_image_counters = {"processed": 0, "failed": 0, "stale": 0}
+
+
+def _variant_files(stem: str) -> dict:
+    return {name: {ext: f"{stem}_{name}.{ext}" for ext in IMAGE_FORMATS} for name in IMAGE_VARIANTS}
+
+
+def _existing_variants(out_dir: str, stem: str):
+    """The variants already on disk for `stem`, None unless every file is there.
+
+    Media stems are content hashes, so files written for the same bytes by an
+    earlier job are exactly what this one would render.
+    """
+    from PIL import Image
+
+    variants = {}
+    for name, files in _variant_files(stem).items():
+        if not all(os.path.exists(os.path.join(out_dir, filename)) for filename in files.values()):
+            return None
+        with Image.open(os.path.join(out_dir, files["jpg"])) as img:
+            width, height = img.size  # header only, no decode
+        variants[name] = {"width": width, "height": height, "files": files}
+    return variants
+
+
+def _save_atomically(img, out_dir: str, filename: str, fmt: str, options: dict):
+    """Write to a private temp file and rename it into place, so concurrent jobs never share a file."""
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=f".{filename}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, fmt, **options)
+        os.replace(tmp_path, os.path.join(out_dir, filename))
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _render_variants(src_path: str, out_dir: str, stem: str) -> dict:
+    """Decode the upload once and write every variant; runs in a worker process.
+
+    Orientation from EXIF is applied to the pixels, then no metadata is
+    carried over, so variants never leak camera or GPS data. Variants are
+    made largest first, each from the previous one. Nothing is rendered when
+    the variants of these bytes already exist.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    existing = _existing_variants(out_dir, stem)
+    if existing is not None:
+        return existing
+
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.load()
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+
+    variants = {}
+    filenames = _variant_files(stem)
+    current = img
+    for name, edge in sorted(IMAGE_VARIANTS.items(), key=lambda v: -v[1]):
+        if max(current.size) > edge:
+            current = current.copy()
+            current.thumbnail((edge, edge), Image.LANCZOS)
+
+        flat = current
+        if current.mode == "RGBA":
+            # JPEG has no alpha: flatten onto white
+            flat = Image.new("RGB", current.size, (255, 255, 255))
+            flat.paste(current, mask=current.getchannel("A"))
+
+        files = filenames[name]
+        for ext, (fmt, options) in IMAGE_FORMATS.items():
+            _save_atomically(current if fmt == "WEBP" else flat, out_dir, files[ext], fmt, options)
+        variants[name] = {"width": current.size[0], "height": current.size[1], "files": files}
+    return variants
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the server already runs Motor's monitor threads, and a
+        # forked child could inherit one of their locks held
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def build_variants(photo_url: str, folder: str, url_prefix: str) -> dict:
+    """Render the variants of an uploaded file; returns {variant: {width, height, webp, jpg}} with URLs."""
+    name = photo_url.rsplit("/", 1)[-1]
+    stem = os.path.splitext(name)[0]
+    loop = asyncio.get_running_loop()
+    rendered = await loop.run_in_executor(
+        _executor(), _render_variants, os.path.join(folder, name), folder, stem
+    )
+    prefix = url_prefix.rstrip("/")
+    return {
+        variant: {
+            "width": info["width"],
+            "height": info["height"],
+            **{ext: f"{prefix}/{filename}" for ext, filename in info["files"].items()},
+        }
+        for variant, info in rendered.items()
+    }
+
+
+async def process_photo(collection: str, doc_id, photo_url: str, folder: str, url_prefix: str,
+                        url_field: str = "photo_url", variants_field: str = "photo_variants"):
+    """Build variants for `photo_url` and record them on the document.
+
+    The write only lands if the document still points at the same photo, so
+    a slow job never overwrites the variants of a newer upload.
+    """
+    try:
+        variants = await build_variants(photo_url, folder, url_prefix)
+    except Exception as e:
+        _image_counters["failed"] += 1
+        print(f"[DEBUG] Image variants for {photo_url} failed: {e!r}")
+        return None
+
+    result = await db[collection].update_one(
+        {"_id": doc_id, url_field: photo_url},
+        {"$set": {variants_field: variants}}
+    )
+    _image_counters["processed" if result.modified_count else "stale"] += 1
+    return variants
+
+
+def process_photo_later(collection: str, doc_id, photo_url: str, folder: str, url_prefix: str, **fields):
+    """Fire-and-forget: the request returns as soon as the original is stored."""
+    asyncio.create_task(process_photo(collection, doc_id, photo_url, folder, url_prefix, **fields))
+
+
+def image_stats() -> dict:
+    return {**_image_counters, "workers": IMAGE_WORKERS}
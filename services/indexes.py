@@ -0,0 +1,155 @@
+# services/indexes.py
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import PyMongoError
+from database import db
+from services.broker import PRESENCE_COLLECTION, PRESENCE_TTL
+
+# Indexes the routers rely on, per collection
+REQUIRED_INDEXES = {
+    "app_user": [
+        IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True, sparse=True),
+    ],
+    "chef_user": [
+        IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True, sparse=True),
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+    ],
+    "delivery_user": [
+        IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True, sparse=True),
+        IndexModel([("location", GEOSPHERE), ("status", ASCENDING)], name="location_2dsphere_status"),
+    ],
+    "orders": [
+        IndexModel([("chef_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)],
+                   name="chef_status_created"),
+        IndexModel([("chef_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="chef_created"),
+        IndexModel([("delivery_boy_id", ASCENDING), ("delivery_status", ASCENDING)],
+                   name="delivery_boy_status"),
+        IndexModel([("delivery_boy_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="delivery_boy_created"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_created"),
+        # checkout retries: one order per (user, Idempotency-Key)
+        IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], name="user_idempotency_key",
+                   unique=True, partialFilterExpression={"idempotency_key": {"$type": "string"}}),
+    ],
+    "food_items": [
+        IndexModel([("chef_id", ASCENDING)], name="chef_id"),
+        IndexModel([("food_style_key", ASCENDING), ("service_type_key", ASCENDING)], name="style_service"),
+        IndexModel([("service_type_key", ASCENDING)], name="service_type"),
+        IndexModel([("food_type_key", ASCENDING)], name="food_type"),
+        IndexModel([("rating", DESCENDING), ("_id", DESCENDING)], name="top_rated"),
+    ],
+    "chef_reviews": [
+        IndexModel([("chef_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="chef_created"),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    PRESENCE_COLLECTION: [
+        # partners of a worker that died disappear once its heartbeats stop
+        IndexModel([("last_seen", ASCENDING)], name="last_seen_ttl", expireAfterSeconds=PRESENCE_TTL),
+    ],
+    "media_blobs": [
+        # GC sweep: unreferenced blobs by age
+        IndexModel([("refs", ASCENDING), ("touched_at", ASCENDING)], name="refs_touched"),
+    ],
+    "addresses": [
+        IndexModel([("user_id", ASCENDING), ("is_default", ASCENDING)], name="user_default"),
+        IndexModel([("id", ASCENDING)], name="address_id"),
+    ],
+}
+
+_SAMPLE_ID = "000000000000000000000000"
+_SAMPLE_POINT = {"type": "Point", "coordinates": [78.4867, 17.3850]}
+
+# Canonical query shapes used by the routers: (name, collection, filter, sort)
+CANONICAL_QUERIES = [
+    ("login by phone", "app_user", {"phone_number": ""}, None),
+    ("chef login by phone", "chef_user", {"phone_number": ""}, None),
+    ("nearby chefs", "chef_user",
+     {"location": {"$near": {"$geometry": _SAMPLE_POINT, "$maxDistance": 5000}}}, None),
+    ("nearby delivery partners", "delivery_user",
+     {"role": "delivery", "status": True,
+      "location": {"$near": {"$geometry": _SAMPLE_POINT, "$maxDistance": 5000}}}, None),
+    ("chef incoming orders", "orders",
+     {"chef_id": _SAMPLE_ID, "status": {"$in": ["new", "pending"]}}, None),
+    ("chef order history", "orders", {"chef_id": _SAMPLE_ID}, [("created_at", -1), ("_id", -1)]),
+    ("user order history", "orders", {"user_id": _SAMPLE_ID}, [("created_at", -1), ("_id", -1)]),
+    ("delivery ongoing orders", "orders",
+     {"delivery_boy_id": _SAMPLE_ID, "delivery_status": {"$in": ["assigned", "picked"]}}, None),
+    ("delivery order history", "orders",
+     {"delivery_boy_id": _SAMPLE_ID}, [("created_at", -1), ("_id", -1)]),
+    ("chef menu", "food_items", {"chef_id": _SAMPLE_ID}, None),
+    ("items by style", "food_items", {"food_style_key": "andhra"}, [("_id", -1)]),
+    ("items by style and service", "food_items",
+     {"food_style_key": "andhra", "service_type_key": "lunch"}, None),
+    ("items by food type", "food_items", {"food_type_key": "veg"}, [("_id", -1)]),
+    ("top rated items", "food_items", {}, [("rating", -1), ("_id", -1)]),
+    ("chef reviews", "chef_reviews", {"chef_id": _SAMPLE_ID}, [("created_at", -1), ("_id", -1)]),
+    ("cart lookup", "carts", {"user_id": _SAMPLE_ID}, None),
+    ("default address", "addresses", {"user_id": _SAMPLE_ID, "is_default": True}, None),
+]
+
+
+async def ensure_indexes() -> dict:
+    """Create any missing index from REQUIRED_INDEXES.
+
+    create_indexes is a no-op for indexes that already exist. A failure on one
+    collection (e.g. duplicate phone numbers blocking a unique index) is
+    reported and does not stop the others.
+    """
+    report = {}
+    for collection, indexes in REQUIRED_INDEXES.items():
+        try:
+            report[collection] = await db[collection].create_indexes(indexes)
+        except PyMongoError as e:
+            print(f"[INDEX] Failed to create indexes on {collection}: {e}")
+            report[collection] = {"error": str(e)}
+    return report
+
+
+def _plan_stages(plan) -> set:
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _plan_stages(value)
+    return stages
+
+
+async def explain_canonical_queries() -> list:
+    """Explain every canonical query and flag the ones that fall back to a COLLSCAN."""
+    results = []
+    for name, collection, query, sort in CANONICAL_QUERIES:
+        cursor = db[collection].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = await cursor.explain()
+        except PyMongoError as e:
+            results.append({"query": name, "collection": collection, "error": str(e)})
+            continue
+
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({
+            "query": name,
+            "collection": collection,
+            "stages": sorted(stages),
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
+
+
+async def run_index_diagnostics():
+    for result in await explain_canonical_queries():
+        if "error" in result:
+            print(f"[INDEX] {result['query']} ({result['collection']}): explain failed: {result['error']}")
+        elif result["collscan"]:
+            print(f"[INDEX] COLLSCAN: {result['query']} ({result['collection']}) stages={result['stages']}")
+        else:
+            print(f"[INDEX] ok: {result['query']} ({result['collection']})")
@@ -0,0 +1,40 @@
+# services/items.py
+from services.cache import TTLCache
+from services.enrichment import fetch_docs_by_id
+
+# What the cart and order flows copy from a food item
+ITEM_METADATA_FIELDS = {"chef_id": 1, "food_name": 1, "price": 1, "photo_url": 1}
+
+# Invalidated by the chef item endpoints on this worker; the TTL bounds
+# how long another worker's price change can go unseen.
+item_cache = TTLCache(maxsize=20000, ttl=60)
+
+
+async def get_items_metadata(food_ids) -> dict:
+    """str(food_id) -> metadata for every id that exists; misses use one $in query.
+
+    The returned documents are shared with the cache and must not be modified.
+    """
+    found = {}
+    missing = []
+    for food_id in dict.fromkeys(str(i) for i in food_ids):
+        item = item_cache.get(food_id)
+        if item is None:
+            missing.append(food_id)
+        else:
+            found[food_id] = item
+
+    if missing:
+        loaded = await fetch_docs_by_id("food_items", missing, ITEM_METADATA_FIELDS)
+        for food_id, item in loaded.items():
+            item_cache.set(food_id, item)
+        found.update(loaded)
+    return found
+
+
+async def get_item_metadata(food_id):
+    return (await get_items_metadata([food_id])).get(str(food_id))
+
+
+def invalidate_item(food_id):
+    item_cache.invalidate(str(food_id))
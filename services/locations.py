@@ -0,0 +1,138 @@
+# services/locations.py
+import asyncio
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from database import db
+from auth.jwt_handler import invalidate_principal
+from services.cache import TTLCache
+from services.distance import haversine
+from services.partners import partner_index
+from services.order_events import publish_order_event
+
+LOCATION_FLUSH_SECONDS = 10   # latest position per rider is written at most this often
+LOCATION_FLUSH_BATCH = 1000   # UpdateOnes per bulk_write
+
+# Pushes to tracking customers: at most one per LOCATION_PUSH_SECONDS per
+# rider, and only once the rider has moved LOCATION_PUSH_METRES since the
+# last push. A standing rider is re-pushed every LOCATION_PUSH_IDLE_SECONDS.
+LOCATION_PUSH_SECONDS = 3
+LOCATION_PUSH_METRES = 15
+LOCATION_PUSH_IDLE_SECONDS = 30
+
+# Delivery statuses during which the customer is watching the rider move
+TRACKED_DELIVERY_STATUSES = ["assigned", "chef_arrived", "picked_up", "out_for_delivery"]
+
+# rider id -> orders it is currently carrying; saves a query per location frame
+rider_orders = TTLCache(maxsize=10000, ttl=30)
+
+# rider id -> (lon, lat, monotonic time) of the last push; expiry is the idle re-push
+_last_push = TTLCache(maxsize=10000, ttl=LOCATION_PUSH_IDLE_SECONDS)
+
+# rider id -> (lon, lat, received_at), only the newest frame since the last flush
+_pending = {}
+_location_counters = {"frames": 0, "invalid_frames": 0, "flushed": 0, "pushed": 0, "push_suppressed": 0,
+                      "flush_failures": 0}
+
+
+def _valid(lon, lat) -> bool:
+    return (
+        isinstance(lon, (int, float)) and isinstance(lat, (int, float))
+        and -180 <= lon <= 180 and -90 <= lat <= 90
+    )
+
+
+async def _tracked_orders(delivery_boy_id: str) -> list:
+    orders = rider_orders.get(delivery_boy_id)
+    if orders is None:
+        orders = await db["orders"].find(
+            {"delivery_boy_id": delivery_boy_id, "delivery_status": {"$in": TRACKED_DELIVERY_STATUSES}},
+            {"user_id": 1, "chef_id": 1}
+        ).to_list(length=None)
+        rider_orders.set(delivery_boy_id, orders)
+    return orders
+
+
+async def record_location(delivery_boy_id: str, longitude, latitude) -> bool:
+    """Accept a location frame from a rider's socket.
+
+    The in-memory dispatch index is updated right away, customers tracking
+    one of the rider's orders get the position pushed (throttled, see
+    LOCATION_PUSH_*), and the database write is deferred to the next
+    periodic flush.
+    """
+    if not _valid(longitude, latitude):
+        _location_counters["invalid_frames"] += 1
+        return False
+
+    _location_counters["frames"] += 1
+    _pending[delivery_boy_id] = (longitude, latitude, datetime.utcnow())
+    partner_index.update_location(delivery_boy_id, longitude, latitude)
+
+    orders = await _tracked_orders(delivery_boy_id)
+    if not orders:
+        return True
+
+    now = time.monotonic()
+    last = _last_push.get(delivery_boy_id)
+    if last is not None:
+        last_lon, last_lat, pushed_at = last
+        if (now - pushed_at < LOCATION_PUSH_SECONDS
+                or haversine(last_lon, last_lat, longitude, latitude) < LOCATION_PUSH_METRES):
+            _location_counters["push_suppressed"] += 1
+            return True
+    _last_push.set(delivery_boy_id, (longitude, latitude, now))
+
+    point = {"type": "Point", "coordinates": [longitude, latitude]}
+    for order in orders:
+        await publish_order_event(order, {"rider_location": point}, roles=("user", "chef"))
+        _location_counters["pushed"] += 1
+    return True
+
+
+async def flush_locations():
+    """Write the newest buffered position of every rider in bulk."""
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+
+    ops = [
+        UpdateOne(
+            {"_id": ObjectId(delivery_boy_id)},
+            {"$set": {
+                "location": {"type": "Point", "coordinates": [lon, lat]},
+                "last_update": received_at
+            }}
+        )
+        for delivery_boy_id, (lon, lat, received_at) in batch.items()
+    ]
+    try:
+        for start in range(0, len(ops), LOCATION_FLUSH_BATCH):
+            await db["delivery_user"].bulk_write(ops[start:start + LOCATION_FLUSH_BATCH], ordered=False)
+    except Exception as e:
+        print(f"[DEBUG] Location flush failed: {e}")
+        _location_counters["flush_failures"] += 1
+        # keep positions that arrived since, retry the rest next time
+        for delivery_boy_id, entry in batch.items():
+            _pending.setdefault(delivery_boy_id, entry)
+        return
+
+    _location_counters["flushed"] += len(ops)
+    for delivery_boy_id in batch:
+        invalidate_principal("delivery", delivery_boy_id)
+
+
+async def flush_locations_forever():
+    while True:
+        await asyncio.sleep(LOCATION_FLUSH_SECONDS)
+        await flush_locations()
+
+
+def location_stats() -> dict:
+    return {
+        **_location_counters,
+        "pending": len(_pending),
+        "rider_orders_cache": rider_orders.stats(),
+    }
@@ -0,0 +1,230 @@
+# services/media.py
+import asyncio
+import glob
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database import db
+from services.uploads import receive_upload, discard_temp, MAX_UPLOAD_BYTES, IMAGE_TYPES
+
+# Uploads are stored once per distinct content, named "<sha256>.<ext>": the URL
+# changes whenever the bytes do, so clients and proxies may cache it forever.
+MEDIA_FOLDER = "uploads/media"
+MEDIA_URL_PREFIX = "/static/media/"
+MEDIA_COLLECTION = "media_blobs"
+
+# Fields that own a media URL, per collection; a blob's `refs` counts these
+MEDIA_OWNERS = {
+    "food_items": ("photo_url",),
+    "chef_user": ("photo_url",),
+    "app_user": ("photo_url",),
+    "delivery_user": ("photo_url", "driving_license_front", "driving_license_back"),
+}
+# Copies taken at the time (cart lines, order history): not counted, but a
+# blob is never collected while one of them still shows it
+MEDIA_SNAPSHOTS = {
+    "carts": ("items.photo_url",),
+    "orders": ("items.photo_url", "chef_summary.profile_pic", "customer_summary.photo_url"),
+}
+
+# Unreferenced blobs are kept this long after their last upload or release
+MEDIA_GC_GRACE = timedelta(hours=int(os.getenv("MEDIA_GC_GRACE_HOURS", 24)))
+MEDIA_GC_INTERVAL = int(os.getenv("MEDIA_GC_INTERVAL", 3600))
+# The sweep claims a blob before unlinking its files; a claim older than this
+# belongs to a sweep that died and may be taken over
+MEDIA_GC_CLAIM_TIMEOUT = timedelta(seconds=60)
+STORE_RETRY_SECONDS = 0.1
+STORE_ATTEMPTS = 50
+
+_media_counters = {"stored": 0, "deduplicated": 0, "collected": 0, "kept_in_use": 0}
+
+
+def media_name(url):
+    """"<sha256>.<ext>" for URLs served from the store, None for anything else."""
+    if isinstance(url, str) and url.startswith(MEDIA_URL_PREFIX):
+        return url[len(MEDIA_URL_PREFIX):]
+    return None
+
+
+def media_projection(collection: str) -> dict:
+    return {field: 1 for field in MEDIA_OWNERS[collection]}
+
+
+def _unclaimed(now: datetime) -> dict:
+    return {"$or": [{"collecting": {"$exists": False}},
+                    {"collecting": {"$lt": now - MEDIA_GC_CLAIM_TIMEOUT}}]}
+
+
+async def store_upload(upload, max_bytes: int = MAX_UPLOAD_BYTES, allowed: dict = IMAGE_TYPES) -> str:
+    """Store an UploadFile by content and return its immutable URL.
+
+    Identical bytes land on the same blob, so re-saving a photo costs no disk.
+    The blob record is touched before the file is moved into place, which
+    keeps the GC sweep off it for the grace period. A blob the sweep has
+    already claimed is waited out and then stored afresh.
+    """
+    tmp_path, ext, digest, size = await receive_upload(upload, MEDIA_FOLDER, max_bytes, allowed)
+    name = f"{digest}.{ext}"
+    path = os.path.join(MEDIA_FOLDER, name)
+    try:
+        for _ in range(STORE_ATTEMPTS):
+            now = datetime.utcnow()
+            try:
+                result = await db[MEDIA_COLLECTION].update_one(
+                    {"_id": name, **_unclaimed(now)},
+                    {"$set": {"touched_at": now}, "$unset": {"collecting": ""},
+                     "$setOnInsert": {"sha256": digest, "ext": ext, "size": size, "refs": 0, "created_at": now}},
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                # claimed by the GC: its files are being removed, the record goes next
+                await asyncio.sleep(STORE_RETRY_SECONDS)
+        else:
+            raise HTTPException(status_code=503, detail="Media store busy, please retry")
+
+        if result.upserted_id is None and os.path.exists(path):
+            discard_temp(tmp_path)
+            _media_counters["deduplicated"] += 1
+        else:
+            os.replace(tmp_path, path)
+            _media_counters["stored"] += 1
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    return MEDIA_URL_PREFIX + name
+
+
+async def update_media_refs(collection: str, before: dict, changes: dict):
+    """Move blob refs after `changes` were $set on a `collection` document that was `before`.
+
+    Pass before=None for a new document, and changes with None values for a
+    deleted one. URLs outside the store are ignored.
+    """
+    before = before or {}
+    deltas = Counter()
+    for field in MEDIA_OWNERS[collection]:
+        if field not in changes or changes[field] == before.get(field):
+            continue
+        deltas[media_name(changes[field])] += 1
+        deltas[media_name(before.get(field))] -= 1
+    deltas.pop(None, None)
+
+    now = datetime.utcnow()
+    ops = [UpdateOne({"_id": name}, {"$inc": {"refs": delta}, "$set": {"touched_at": now}})
+           for name, delta in deltas.items() if delta]
+    if ops:
+        await db[MEDIA_COLLECTION].bulk_write(ops, ordered=False)
+
+
+async def release_media_refs(collection: str, doc: dict):
+    """Drop the refs a deleted document held."""
+    if doc:
+        await update_media_refs(collection, doc, {field: None for field in MEDIA_OWNERS[collection]})
+
+
+async def _in_use(names) -> set:
+    """Which of `names` some document still shows, owner or snapshot."""
+    urls = [MEDIA_URL_PREFIX + name for name in names]
+    found = set()
+    for collection, fields in {**MEDIA_OWNERS, **MEDIA_SNAPSHOTS}.items():
+        for field in fields:
+            values = await db[collection].distinct(field, {field: {"$in": urls}})
+            found.update(media_name(v) for v in values)
+    return found & set(names)
+
+
+def _remove_files(name: str):
+    stem = name.rsplit(".", 1)[0]
+    # the original and the variants rendered from it (services/images.py)
+    for path in [os.path.join(MEDIA_FOLDER, name), *glob.glob(os.path.join(MEDIA_FOLDER, f"{stem}_*"))]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+async def collect_media(batch_size: int = 500) -> int:
+    """GC sweep: delete blobs with no refs that were untouched for MEDIA_GC_GRACE.
+
+    Candidates are re-checked against the documents first, so a ref count
+    that drifted low never costs a file that is still shown somewhere. Each
+    blob is claimed before its files go and its record is deleted after, so
+    an upload of the same bytes meanwhile waits and stores them again.
+    """
+    cutoff = datetime.utcnow() - MEDIA_GC_GRACE
+    unreferenced = {"refs": {"$lte": 0}, "touched_at": {"$lt": cutoff}}
+    candidates = await db[MEDIA_COLLECTION].find(unreferenced, {"_id": 1}).to_list(length=batch_size)
+    names = [blob["_id"] for blob in candidates]
+    if not names:
+        return 0
+
+    in_use = await _in_use(names)
+    if in_use:
+        # look again after another grace period; recount_media_refs fixes drifted owners
+        await db[MEDIA_COLLECTION].update_many(
+            {"_id": {"$in": list(in_use)}}, {"$set": {"touched_at": datetime.utcnow()}}
+        )
+        _media_counters["kept_in_use"] += len(in_use)
+
+    removed = 0
+    for name in names:
+        if name in in_use:
+            continue
+        # conditional: an upload of the same bytes since the query re-touched it
+        claim = datetime.utcnow()
+        result = await db[MEDIA_COLLECTION].update_one(
+            {"_id": name, **unreferenced, **_unclaimed(claim)}, {"$set": {"collecting": claim}}
+        )
+        if not result.modified_count:
+            continue
+        await asyncio.to_thread(_remove_files, name)
+        await db[MEDIA_COLLECTION].delete_one({"_id": name, "collecting": claim})
+        removed += 1
+
+    _media_counters["collected"] += removed
+    print(f"[DEBUG] Media GC removed {removed} of {len(names)} unreferenced blobs")
+    return removed
+
+
+async def collect_media_forever():
+    while True:
+        await asyncio.sleep(MEDIA_GC_INTERVAL)
+        try:
+            await collect_media()
+        except Exception as e:
+            print(f"[DEBUG] Media GC failed: {e}")
+
+
+async def recount_media_refs() -> int:
+    """Repair: recompute every blob's refs from the owning documents."""
+    counts = Counter()
+    for collection, fields in MEDIA_OWNERS.items():
+        for field in fields:
+            cursor = db[collection].aggregate([
+                {"$match": {field: {"$regex": f"^{MEDIA_URL_PREFIX}"}}},
+                {"$group": {"_id": f"${field}", "n": {"$sum": 1}}},
+            ])
+            async for row in cursor:
+                counts[media_name(row["_id"])] += row["n"]
+
+    ops = []
+    async for blob in db[MEDIA_COLLECTION].find({}, {"refs": 1}):
+        refs = counts.get(blob["_id"], 0)
+        if blob.get("refs") != refs:
+            ops.append(UpdateOne({"_id": blob["_id"]}, {"$set": {"refs": refs}}))
+    if ops:
+        await db[MEDIA_COLLECTION].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def media_stats() -> dict:
+    return {**_media_counters, "grace_hours": MEDIA_GC_GRACE.total_seconds() / 3600}
+
+
+if __name__ == "__main__":
+    # python -m services.media
+    print(f"Corrected refs on {asyncio.run(recount_media_refs())} blobs")
@@ -0,0 +1,208 @@
+# services/media_serving.py
+import asyncio
+import email.utils
+import mimetypes
+import os
+import re
+import stat
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from services.cache import TTLCache
+
+mimetypes.add_type("image/webp", ".webp")
+
+READ_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=86400"
+
+# Media store names: "<sha256>.<ext>" originals and "<sha256>_<variant>.<ext>" renders
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$")
+
+# path -> file metadata, so a request costs no stat(). Files are only ever
+# created or replaced whole; the TTL bounds how long a replacement goes unseen.
+file_meta_cache = TTLCache(maxsize=20000, ttl=60)
+
+# Optional hot-file cache: bodies of small files (menu photos) requested at
+# least HOT_CACHE_ADMIT_AFTER times. Off unless MEDIA_HOT_CACHE_FILES is set;
+# memory stays under files * MEDIA_HOT_CACHE_MAX_KB.
+HOT_CACHE_FILES = int(os.getenv("MEDIA_HOT_CACHE_FILES", 0))
+HOT_CACHE_MAX_BYTES = int(os.getenv("MEDIA_HOT_CACHE_MAX_KB", 256)) * 1024
+HOT_CACHE_ADMIT_AFTER = 3
+hot_file_cache = TTLCache(maxsize=max(HOT_CACHE_FILES, 1), ttl=600)
+_hot_requests = TTLCache(maxsize=max(HOT_CACHE_FILES * 4, 1), ttl=600)
+
+
+def _resolve(root: str, relpath: str):
+    """Path of `relpath` under `root`; None for traversal, empty or hidden parts (temp uploads)."""
+    parts = relpath.split("/")
+    if any(not part or part == ".." or part.startswith(".") or "\\" in part for part in parts):
+        return None
+    return os.path.join(root, *parts)
+
+
+def _file_meta(path: str):
+    meta = file_meta_cache.get(path)
+    if meta is not None:
+        return meta
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    name = os.path.basename(path)
+    immutable = bool(_CONTENT_ADDRESSED.match(name))
+    stem = name.split(".", 1)[0]
+    meta = {
+        "path": path,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        # an original's hash is its strong validator; anything else changes mtime when replaced
+        "etag": f'"{stem}"' if immutable and "_" not in stem else f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+        "immutable": immutable,
+        "media_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+    }
+    file_meta_cache.set(path, meta)
+    return meta
+
+
+def _not_modified(request, meta: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, as RFC 9110 requires for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or meta["etag"] in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(meta["mtime"]) <= since
+    return False
+
+
+def _byte_range(request, meta: dict):
+    """(start, end) inclusive for a single satisfiable range, None to send the whole file.
+
+    Multiple ranges and an If-Range that no longer matches get the whole file;
+    an unsatisfiable range is a 416.
+    """
+    header = request.headers.get("range")
+    if not header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != meta["etag"]:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    size = meta["size"]
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), (int(last) if last else size - 1)
+        else:
+            suffix = int(last)  # "-N": the last N bytes
+            start, end = (max(size - suffix, 0), size - 1) if suffix else (size, size)
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def _read_file(f, start: int, end: int):
+    try:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _read_whole(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _hot_body(meta: dict):
+    """The cached body of a hot file, loading it once it has been asked for often enough."""
+    if not HOT_CACHE_FILES or meta["size"] > HOT_CACHE_MAX_BYTES:
+        return None
+    key = (meta["path"], meta["etag"])
+    body = hot_file_cache.get(key)
+    if body is None:
+        seen = (_hot_requests.get(key) or 0) + 1
+        _hot_requests.set(key, seen)
+        if seen < HOT_CACHE_ADMIT_AFTER:
+            return None
+        body = await asyncio.to_thread(_read_whole, meta["path"])
+        hot_file_cache.set(key, body)
+    return body
+
+
+async def serve_file(request, root: str, relpath: str, fallbacks=()):
+    """GET/HEAD response for `relpath` under `root` (or the first of `fallbacks` that exists).
+
+    Sends a strong ETag and Last-Modified, answers conditional requests with
+    304 and single byte ranges with 206. Content-addressed names are cached
+    by clients for a year as immutable.
+    """
+    meta = None
+    for candidate in (relpath, *fallbacks):
+        path = _resolve(root, candidate)
+        meta = _file_meta(path) if path else None
+        if meta:
+            break
+    if meta is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "ETag": meta["etag"],
+        "Last-Modified": email.utils.formatdate(meta["mtime"], usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if meta["immutable"] else DEFAULT_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if _not_modified(request, meta):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _byte_range(request, meta)
+    start, end = byte_range or (0, meta["size"] - 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{meta['size']}"
+    headers["Content-Length"] = str(end - start + 1)
+    status_code = 206 if byte_range else 200
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=meta["media_type"])
+
+    body = await _hot_body(meta)
+    if body is not None:
+        return Response(body[start:end + 1], status_code=status_code, headers=headers,
+                        media_type=meta["media_type"])
+
+    try:
+        f = await asyncio.to_thread(open, meta["path"], "rb")
+    except FileNotFoundError:
+        # removed since its metadata was cached (media GC)
+        file_meta_cache.invalidate(meta["path"])
+        raise HTTPException(status_code=404, detail="File not found")
+    return StreamingResponse(_read_file(f, start, end), status_code=status_code, headers=headers,
+                             media_type=meta["media_type"])
+
+
+def media_serving_stats() -> dict:
+    return {
+        "file_meta_cache": file_meta_cache.stats(),
+        "hot_file_cache": hot_file_cache.stats() if HOT_CACHE_FILES else None,
+    }
@@ -0,0 +1,119 @@
+# services/order_events.py
+import asyncio
+import json
+from datetime import datetime
+from services.broker import broker
+
+SUBSCRIBER_QUEUE_SIZE = 100  # events buffered per stream before it is closed
+KEEPALIVE_SECONDS = 15       # SSE comment sent when idle, keeps proxies from timing out
+
+# Which order field identifies each role's party to the order
+AUDIENCE_FIELDS = {"user": "user_id", "chef": "chef_id", "delivery": "delivery_boy_id"}
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscription:
+    def __init__(self, role: str, principal_id: str, order_id: str = None):
+        self.key = (role, principal_id)
+        self.order_id = order_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        if self.order_id and event["order_id"] != self.order_id:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # the client has fallen behind; end the stream so it refetches once
+            self.overflowed = True
+
+
+class OrderEventHub:
+    """Fan-out of order deltas to the SSE streams of the order's user, chef and rider."""
+
+    def __init__(self):
+        self._subscribers = {}  # (role, principal_id) -> set of Subscription
+        self.counters = {"published": 0, "delivered": 0, "overflowed": 0}
+
+    def subscribe(self, role: str, principal_id: str, order_id: str = None) -> Subscription:
+        sub = Subscription(role, principal_id, order_id)
+        self._subscribers.setdefault(sub.key, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subscribers.get(sub.key)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.key]
+        if sub.overflowed:
+            self.counters["overflowed"] += 1
+
+    def deliver(self, event: dict):
+        """Hand an event (published on any worker) to local subscribers."""
+        for role, principal_id in event["audience"]:
+            for sub in self._subscribers.get((role, principal_id), ()):
+                sub.offer(event)
+                self.counters["delivered"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "streams": sum(len(subs) for subs in self._subscribers.values()),
+            **self.counters,
+        }
+
+
+order_events = OrderEventHub()
+broker.on_event = order_events.deliver
+
+
+async def publish_order_event(order: dict, changes: dict, roles=tuple(AUDIENCE_FIELDS)):
+    """Publish the fields that just changed on `order` to everyone following it.
+
+    `order` only needs _id and the party fields (user_id, chef_id,
+    delivery_boy_id); `changes` is the $set that was applied. `roles`
+    limits which parties receive it.
+    """
+    audience = []
+    for role in roles:
+        field = AUDIENCE_FIELDS[role]
+        party = changes.get(field) or order.get(field)
+        if party:
+            audience.append((role, str(party)))
+
+    event = {
+        "type": "order_update",
+        "order_id": str(order["_id"]),
+        "changes": changes,
+        "at": datetime.utcnow().isoformat(),
+        "audience": audience,
+    }
+    order_events.counters["published"] += 1
+    try:
+        await broker.publish(event)
+    except Exception as e:
+        # never fail the write that triggered the event
+        print(f"[DEBUG] Publishing order event for {event['order_id']} failed: {e}")
+
+
+async def stream_order_events(sub: Subscription):
+    """Server-sent events for one subscription; ends when the client falls behind."""
+    try:
+        yield "retry: 3000\n\n"
+        while not sub.overflowed:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            payload = {key: value for key, value in event.items() if key != "audience"}
+            yield f"event: order_update\ndata: {json.dumps(payload, default=_jsonable)}\n\n"
+        yield "event: resync\ndata: {}\n\n"
+    finally:
+        order_events.unsubscribe(sub)
@@ -0,0 +1,107 @@
+# services/order_summary.py
+import asyncio
+from pymongo import UpdateOne
+from database import db
+from services.enrichment import fetch_docs_by_id
+
+# What listing screens show about each party, snapshotted onto the order:
+# role -> (profile collection, order field, summary field, {summary key: profile field})
+SUMMARY_SOURCES = {
+    "chef": ("chef_user", "chef_id", "chef_summary",
+             {"name": "name", "phone": "phone_number", "profile_pic": "photo_url", "location": "location"}),
+    "user": ("app_user", "user_id", "customer_summary",
+             {"name": "name", "phone": "phone_number", "email": "email",
+              "photo_url": "photo_url", "location": "location",
+              # shown by /chef/orders/ongoing
+              "role": "role", "is_online": "is_online", "last_seen": "last_seen",
+              "created_at": "created_at"}),
+    "delivery": ("delivery_user", "delivery_boy_id", "rider_summary",
+                 {"name": "name", "phone": "phone_number"}),
+}
+
+# Fields listings never show
+LISTING_EXCLUDE = {"idempotency_key": 0}
+
+
+def profile_projection(role: str) -> dict:
+    return {field: 1 for field in SUMMARY_SOURCES[role][3].values()}
+
+
+def summarize(role: str, profile: dict) -> dict:
+    """The summary sub-document for `role` built from its profile document."""
+    fields = SUMMARY_SOURCES[role][3]
+    return {key: (profile or {}).get(field) for key, field in fields.items()}
+
+
+def summary_field(role: str) -> str:
+    return SUMMARY_SOURCES[role][2]
+
+
+async def refresh_order_summaries(role: str, party_id, changes: dict) -> int:
+    """Copy changed profile fields onto every order the party is part of.
+
+    Call after a profile or location update with the $set that was applied;
+    fields the summary does not show are ignored.
+    """
+    _, order_field, summary, fields = SUMMARY_SOURCES[role]
+    update = {
+        f"{summary}.{key}": changes[field]
+        for key, field in fields.items() if field in changes
+    }
+    if not update:
+        return 0
+    result = await db["orders"].update_many({order_field: str(party_id)}, {"$set": update})
+    return result.modified_count
+
+
+def refresh_order_summaries_later(role: str, party_id, changes: dict):
+    """Fire-and-forget refresh, so the profile request does not wait on order history."""
+    async def run():
+        try:
+            await refresh_order_summaries(role, party_id, changes)
+        except Exception as e:
+            print(f"[DEBUG] Refreshing order summaries for {role} {party_id} failed: {e}")
+    asyncio.create_task(run())
+
+
+async def backfill_order_summaries(batch_size: int = 500) -> int:
+    """Migration: snapshot party summaries onto orders written before they existed."""
+    updated = 0
+    cursor = db["orders"].find(
+        {"$or": [
+            {"chef_summary": {"$exists": False}},
+            # also re-snapshots customer summaries written before `created_at` was added
+            {"customer_summary.created_at": {"$exists": False}},
+            {"delivery_boy_id": {"$nin": [None, ""]}, "rider_summary": {"$exists": False}},
+        ]},
+        {"chef_id": 1, "user_id": 1, "delivery_boy_id": 1},
+    ).batch_size(batch_size)
+
+    while True:
+        orders = await cursor.to_list(length=batch_size)
+        if not orders:
+            break
+
+        profiles = dict(zip(SUMMARY_SOURCES, await asyncio.gather(*(
+            fetch_docs_by_id(collection, [o.get(order_field) for o in orders], profile_projection(role))
+            for role, (collection, order_field, _, _) in SUMMARY_SOURCES.items()
+        ))))
+
+        batch = []
+        for order in orders:
+            update = {}
+            for role, (_, order_field, summary, _) in SUMMARY_SOURCES.items():
+                # riders only once one is assigned; unknown chefs/customers get an empty summary
+                if order.get(order_field) or role != "delivery":
+                    update[summary] = summarize(role, profiles[role].get(str(order.get(order_field))))
+            batch.append(UpdateOne({"_id": order["_id"]}, {"$set": update}))
+
+        result = await db["orders"].bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    return updated
+
+
+if __name__ == "__main__":
+    # python -m services.order_summary
+    print(f"Backfilled summaries on {asyncio.run(backfill_order_summaries())} orders")
@@ -0,0 +1,98 @@
+# services/pagination.py
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100  # hard server-side cap, whatever the client asks for
+
+
+def clamp_limit(limit: int = None) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"oid": str(value)}
+    return {"v": value}
+
+
+def _decode_value(data: dict):
+    if "dt" in data:
+        return datetime.fromisoformat(data["dt"])
+    if "oid" in data:
+        return ObjectId(data["oid"])
+    return data.get("v")
+
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    """Build an opaque continuation token from the last document of a page."""
+    payload = {"id": str(doc["_id"])}
+    if sort_field != "_id":
+        payload["k"] = _encode_value(doc.get(sort_field))
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        result = {"id": ObjectId(payload["id"])}
+        if "k" in payload:
+            result["key"] = _decode_value(payload["k"])
+        return result
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(token: str, sort_field: str, direction: int = -1) -> dict:
+    """Query fragment selecting the documents that come after `token`."""
+    position = decode_cursor(token)
+    op = "$lt" if direction < 0 else "$gt"
+
+    if sort_field == "_id":
+        return {"_id": {op: position["id"]}}
+
+    key = position.get("key")
+    return {"$or": [
+        {sort_field: {op: key}},
+        {sort_field: key, "_id": {op: position["id"]}},
+    ]}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    cursor: str = None,
+    limit: int = None,
+    sort_field: str = "created_at",
+    direction: int = -1,
+    projection: dict = None,
+):
+    """Run a keyset-paginated find on `collection` ordered by (sort_field, _id).
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    """
+    limit = clamp_limit(limit)
+
+    if cursor:
+        query = {"$and": [query, keyset_filter(cursor, sort_field, direction)]}
+
+    sort = [("_id", direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+
+    # Fetch one extra document to know whether another page exists
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort_field)
+
+    return docs, next_cursor
@@ -0,0 +1,137 @@
+# services/partners.py
+import math
+from services.distance import EARTH_RADIUS_M, distances_from
+
+CELL_DEG = 0.01           # ~1.1 km grid cells
+
+
+def _cell(lon, lat):
+    return int(math.floor(lon / CELL_DEG)), int(math.floor(lat / CELL_DEG))
+
+
+def _ring(cx, cy, r):
+    if r == 0:
+        yield cx, cy
+        return
+    for dx in range(-r, r + 1):
+        yield cx + dx, cy - r
+        yield cx + dx, cy + r
+    for dy in range(-r + 1, r):
+        yield cx - r, cy + dy
+        yield cx + r, cy + dy
+
+
+class PartnerGeoIndex:
+    """Grid-bucketed positions of delivery partners connected to this process."""
+
+    def __init__(self):
+        self._partners = {}  # partner_id -> {"name", "lon", "lat", "online", "cell"}
+        self._cells = {}     # (cx, cy) -> set of online partner ids
+
+    def _unbucket(self, partner_id, partner):
+        cell = partner.get("cell")
+        if cell is not None:
+            members = self._cells.get(cell)
+            if members is not None:
+                members.discard(partner_id)
+                if not members:
+                    del self._cells[cell]
+            partner["cell"] = None
+
+    def _bucket(self, partner_id, partner):
+        if partner["online"] and partner["lon"] is not None:
+            partner["cell"] = _cell(partner["lon"], partner["lat"])
+            self._cells.setdefault(partner["cell"], set()).add(partner_id)
+
+    def _entry(self, partner_id):
+        return self._partners.setdefault(
+            partner_id, {"name": None, "lon": None, "lat": None, "online": False, "cell": None}
+        )
+
+    def update_location(self, partner_id: str, lon: float, lat: float):
+        partner = self._entry(partner_id)
+        if partner["cell"] is not None and partner["cell"] == _cell(lon, lat):
+            partner["lon"], partner["lat"] = lon, lat
+            return
+        self._unbucket(partner_id, partner)
+        partner["lon"], partner["lat"] = lon, lat
+        self._bucket(partner_id, partner)
+
+    def set_online(self, partner_id: str, name: str = None, coordinates=None):
+        partner = self._entry(partner_id)
+        self._unbucket(partner_id, partner)
+        partner["online"] = True
+        if name is not None:
+            partner["name"] = name
+        if coordinates:
+            partner["lon"], partner["lat"] = coordinates[0], coordinates[1]
+        self._bucket(partner_id, partner)
+
+    def set_offline(self, partner_id: str):
+        partner = self._partners.get(partner_id)
+        if partner is not None:
+            self._unbucket(partner_id, partner)
+            partner["online"] = False
+
+    def online_count(self) -> int:
+        return sum(len(members) for members in self._cells.values())
+
+    def location(self, partner_id: str):
+        partner = self._partners.get(partner_id)
+        if partner is None or partner["lon"] is None:
+            return None
+        return [partner["lon"], partner["lat"]]
+
+    def nearest(self, lon: float, lat: float, k: int = None, max_distance: int = 5000) -> list:
+        """Online partners within max_distance metres, nearest first (at most k).
+
+        Rings of grid cells are scanned outwards until every unvisited cell is
+        provably farther than the k-th hit or than max_distance.
+        """
+        cx, cy = _cell(lon, lat)
+        # narrowest side of a cell at this latitude, in metres
+        cell_m = CELL_DEG * math.radians(1) * EARTH_RADIUS_M * max(math.cos(math.radians(abs(lat) + CELL_DEG)), 0.01)
+
+        hits = []
+        r = 0
+        while True:
+            ring_ids = [
+                partner_id
+                for cell in _ring(cx, cy, r)
+                for partner_id in self._cells.get(cell, ())
+            ]
+            if ring_ids:
+                points = [(self._partners[p]["lon"], self._partners[p]["lat"]) for p in ring_ids]
+                for partner_id, distance in zip(ring_ids, distances_from((lon, lat), points).tolist()):
+                    if distance <= max_distance:
+                        hits.append((distance, partner_id))
+
+            # anything not visited yet is at least this far away
+            reach = r * cell_m
+            if reach > max_distance or not self._cells:
+                break
+            if k and len(hits) >= k:
+                hits.sort()
+                if hits[k - 1][0] <= reach:
+                    break
+            r += 1
+
+        hits.sort()
+        if k:
+            hits = hits[:k]
+
+        return [
+            {
+                "id": partner_id,
+                "name": self._partners[partner_id]["name"],
+                "location": {
+                    "type": "Point",
+                    "coordinates": [self._partners[partner_id]["lon"], self._partners[partner_id]["lat"]],
+                },
+                "distance_meters": round(distance, 2),
+            }
+            for distance, partner_id in hits
+        ]
+
+
+partner_index = PartnerGeoIndex()
@@ -0,0 +1,122 @@
+# services/ratings.py
+import asyncio
+from pymongo import ReturnDocument
+from database import db
+
+RATING_VALUES = range(1, 6)
+
+
+def _plus(path: str, amount=1):
+    return {"$add": [{"$ifNull": ["$" + path, 0]}, amount]}
+
+
+async def record_review(chef_id, taste_rating: int, portion_rating: int):
+    """Fold one review into the chef's running rating aggregates.
+
+    A single pipeline update keeps count, sums, histograms and the derived
+    averages consistent without reading the reviews back. Returns the
+    updated chef document, or None if the chef does not exist.
+    """
+    chef = await db["chef_user"].find_one_and_update(
+        {"_id": chef_id},
+        [
+            {"$set": {
+                "rating_summary.count": _plus("rating_summary.count"),
+                "rating_summary.taste_sum": _plus("rating_summary.taste_sum", taste_rating),
+                "rating_summary.portion_sum": _plus("rating_summary.portion_sum", portion_rating),
+                f"rating_summary.taste_histogram.{taste_rating}":
+                    _plus(f"rating_summary.taste_histogram.{taste_rating}"),
+                f"rating_summary.portion_histogram.{portion_rating}":
+                    _plus(f"rating_summary.portion_histogram.{portion_rating}"),
+            }},
+            {"$set": {
+                "rating": {"$round": [
+                    {"$divide": [
+                        {"$add": ["$rating_summary.taste_sum", "$rating_summary.portion_sum"]},
+                        {"$multiply": ["$rating_summary.count", 2]},
+                    ]},
+                    2,
+                ]},
+            }},
+        ],
+        projection={"rating": 1, "rating_summary": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+
+    if chef:
+        # Denormalized onto the menu so "top rated" sorting is a plain indexed sort
+        await db["food_items"].update_many({"chef_id": chef_id}, {"$set": {"rating": chef["rating"]}})
+    return chef
+
+
+def format_rating_summary(summary: dict) -> dict:
+    """Public shape of a chef's rating aggregates."""
+    summary = summary or {}
+    count = summary.get("count", 0)
+    taste_histogram = summary.get("taste_histogram") or {}
+    portion_histogram = summary.get("portion_histogram") or {}
+    return {
+        "count": count,
+        "average_ratings": {
+            "taste": round(summary.get("taste_sum", 0) / count, 1) if count else 0,
+            "portion": round(summary.get("portion_sum", 0) / count, 1) if count else 0,
+        },
+        "histogram": {
+            "taste": {str(v): taste_histogram.get(str(v), 0) for v in RATING_VALUES},
+            "portion": {str(v): portion_histogram.get(str(v), 0) for v in RATING_VALUES},
+        },
+    }
+
+
+async def compute_rating_summary(chef_id) -> dict:
+    """Rebuild a chef's aggregates from chef_reviews (O(reviews), used for backfill)."""
+    summary = {
+        "count": 0,
+        "taste_sum": 0,
+        "portion_sum": 0,
+        "taste_histogram": {},
+        "portion_histogram": {},
+    }
+    rows = await db["chef_reviews"].aggregate([
+        {"$match": {"chef_id": chef_id}},
+        {"$group": {
+            "_id": {"taste": "$taste_rating", "portion": "$portion_rating"},
+            "n": {"$sum": 1},
+        }},
+    ]).to_list(length=None)
+
+    for row in rows:
+        taste, portion, n = row["_id"]["taste"], row["_id"]["portion"], row["n"]
+        summary["count"] += n
+        summary["taste_sum"] += taste * n
+        summary["portion_sum"] += portion * n
+        summary["taste_histogram"][str(taste)] = summary["taste_histogram"].get(str(taste), 0) + n
+        summary["portion_histogram"][str(portion)] = summary["portion_histogram"].get(str(portion), 0) + n
+    return summary
+
+
+async def backfill_rating_summaries() -> int:
+    """Migration: compute aggregates for every chef that has reviews but no summary yet."""
+    chef_ids = await db["chef_reviews"].distinct("chef_id")
+    missing = await db["chef_user"].find(
+        {"_id": {"$in": chef_ids}, "rating_summary": {"$exists": False}}, {"_id": 1}
+    ).to_list(length=None)
+
+    updated = 0
+    for chef in missing:
+        summary = await compute_rating_summary(chef["_id"])
+        if not summary["count"]:
+            continue
+        rating = round((summary["taste_sum"] + summary["portion_sum"]) / (2 * summary["count"]), 2)
+        await db["chef_user"].update_one(
+            {"_id": chef["_id"], "rating_summary": {"$exists": False}},
+            {"$set": {"rating_summary": summary, "rating": rating}},
+        )
+        await db["food_items"].update_many({"chef_id": chef["_id"]}, {"$set": {"rating": rating}})
+        updated += 1
+    return updated
+
+
+if __name__ == "__main__":
+    # python -m services.ratings
+    print(f"Backfilled rating summaries for {asyncio.run(backfill_rating_summaries())} chefs")
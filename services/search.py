@@ -0,0 +1,275 @@
+# services/search.py
+import asyncio
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Ranking weights
+EXACT_MATCH_WEIGHT = 1.0
+PREFIX_MATCH_WEIGHT = 0.6
+RATING_WEIGHT = 0.1        # per rating star on top of text relevance
+DISTANCE_HALF_KM = 5.0     # relevance halves at this distance from the user
+
+SEARCH_REFRESH_SECONDS = 300  # full rebuild, picks up writes made by other workers
+
+
+def tokenize(text) -> list:
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(t) for t in text if t)
+    return _TOKEN.findall(str(text).lower())
+
+
+def _approx_km(lon1, lat1, lon2, lat2) -> float:
+    # Equirectangular approximation: accurate enough for ranking within a city
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371.0 * math.hypot(x, y)
+
+
+class SearchIndex:
+    """In-process inverted index over food items and chefs with prefix lookup."""
+
+    def __init__(self):
+        self._docs = {}                    # key -> result payload
+        self._doc_tokens = {}              # key -> set of tokens
+        self._postings = defaultdict(set)  # token -> set of keys
+        self._vocab = []                   # sorted tokens, for prefix expansion
+        self._chefs = {}                   # chef_id -> {"name", "location", "rating"}
+        self._chef_postings = {}           # token -> chef_id -> set of keys, for ranked scans
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ---------------- writes ----------------
+    def _add_tokens(self, key, tokens):
+        self._doc_tokens[key] = tokens
+        chef_id = self._chef_id(key)
+        for token in tokens:
+            postings = self._postings[token]
+            if not postings:
+                insort(self._vocab, token)
+            postings.add(key)
+            self._chef_postings.setdefault(token, {}).setdefault(chef_id, set()).add(key)
+
+    def remove(self, key):
+        chef_id = self._chef_id(key) if key in self._docs else None
+        self._docs.pop(key, None)
+        for token in self._doc_tokens.pop(key, ()):
+            by_chef = self._chef_postings.get(token, {})
+            keys = by_chef.get(chef_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del by_chef[chef_id]
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(key)
+            if not postings:
+                del self._postings[token]
+                self._chef_postings.pop(token, None)
+                i = bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def index_item(self, item: dict):
+        key = ("item", str(item["_id"]))
+        self.remove(key)
+        self._docs[key] = {
+            "type": "item",
+            "id": str(item["_id"]),
+            "chef_id": str(item.get("chef_id")),
+            "food_name": item.get("food_name"),
+            "food_style": item.get("food_style"),
+            "food_type": item.get("food_type"),
+            "service_type": item.get("service_type"),
+            "price": item.get("price"),
+            "photo_url": item.get("photo_url"),
+        }
+        self._add_tokens(key, set(tokenize([
+            item.get("food_name"), item.get("food_style"), item.get("food_type"), item.get("service_type"),
+        ])))
+
+    def remove_item(self, item_id):
+        self.remove(("item", str(item_id)))
+
+    def index_chef(self, chef: dict):
+        chef_id = str(chef["_id"])
+        key = ("chef", chef_id)
+        location = (chef.get("location") or {}).get("coordinates")
+        self._chefs[chef_id] = {
+            "name": chef.get("name"),
+            "location": location,
+            "rating": chef.get("rating"),
+        }
+        self.remove(key)
+        self._docs[key] = {
+            "type": "chef",
+            "id": chef_id,
+            "name": chef.get("name"),
+            "photo_url": chef.get("photo_url"),
+            "food_styles": chef.get("food_styles"),
+        }
+        self._add_tokens(key, set(tokenize([
+            chef.get("name"), chef.get("food_styles"), chef.get("specialty"),
+        ])))
+
+    def update_chef_location(self, chef_id, coordinates):
+        chef = self._chefs.get(str(chef_id))
+        if chef is not None:
+            chef["location"] = coordinates
+
+    def update_chef_rating(self, chef_id, rating):
+        chef = self._chefs.get(str(chef_id))
+        if chef is not None:
+            chef["rating"] = rating
+
+    # ---------------- reads ----------------
+    def _expand(self, prefix: str) -> list:
+        i = bisect_left(self._vocab, prefix)
+        tokens = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            tokens.append(self._vocab[i])
+            i += 1
+        return tokens
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """Vocabulary completions for the last word typed, most common first."""
+        words = tokenize(prefix)
+        if not words:
+            return []
+        tokens = self._expand(words[-1])
+        return heapq.nlargest(limit, tokens, key=lambda t: len(self._postings[t]))
+
+    def _weighted_tokens(self, word: str, total: int) -> list:
+        """(weight, postings, token) for every vocabulary token matching `word`, best first."""
+        weighted = []
+        for token in self._expand(word):
+            postings = self._postings[token]
+            weight = math.log(1 + total / len(postings))
+            weight *= EXACT_MATCH_WEIGHT if token == word else PREFIX_MATCH_WEIGHT
+            weighted.append((weight, postings, token))
+        weighted.sort(key=lambda wp: wp[0], reverse=True)
+        return weighted
+
+    def _chef_id(self, key) -> str:
+        doc = self._docs[key]
+        return doc["chef_id"] if key[0] == "item" else doc["id"]
+
+    def _chef_boost(self, chef_id, origin) -> tuple:
+        """(score multiplier, distance_km or None) from the chef's rating and distance."""
+        chef = self._chefs.get(chef_id, {})
+        boost = 1 + RATING_WEIGHT * (chef.get("rating") or 0)
+        distance_km = None
+        if origin and chef.get("location"):
+            distance_km = _approx_km(origin[0], origin[1], *chef["location"])
+            boost /= 1 + distance_km / DISTANCE_HALF_KM
+        return boost, distance_km
+
+    def search(self, query: str, limit: int = 20, kind: str = None, origin=None) -> list:
+        """Every query word must match a document word exactly or as a prefix.
+
+        Text relevance is idf-weighted (exact matches beat prefix matches) and
+        boosted by chef rating and by distance from `origin` ([lon, lat]) when
+        given. Candidates are drawn from the rarest query word, best-matching
+        tokens first and, within a token, chef by chef in order of that boost;
+        a token's scan stops at the first chef whose documents could not reach
+        the current top `limit`, so common prefixes rarely visit the whole
+        catalog yet the results are always the best matches.
+        """
+        words = tokenize(query)
+        if not words or limit <= 0:
+            return []
+
+        total = len(self._docs) or 1
+        per_word = [self._weighted_tokens(word, total) for word in dict.fromkeys(words)]
+        if any(not weighted for weighted in per_word):
+            return []
+
+        # Drive from the word with the fewest matching documents
+        per_word.sort(key=lambda weighted: sum(len(p) for _, p, _ in weighted))
+        driver, others = per_word[0], per_word[1:]
+        others_best = sum(weighted[0][0] for weighted in others)
+
+        top = []  # min-heap of (score, key, distance_km), at most `limit` long
+        seen = set()
+        boosts = {}  # chef_id -> (boost, distance_km) for this query
+        for weight, _, token in driver:
+            bound = weight + others_best  # best text score a document of this token can have
+            by_chef = self._chef_postings[token]
+            for chef_id in by_chef:
+                if chef_id not in boosts:
+                    boosts[chef_id] = self._chef_boost(chef_id, origin)
+            for chef_id in sorted(by_chef, key=lambda c: boosts[c][0], reverse=True):
+                boost, distance_km = boosts[chef_id]
+                if len(top) >= limit and bound * boost <= top[0][0]:
+                    break  # chefs come best boost first: nothing further can make the cut
+                for key in by_chef[chef_id]:
+                    if key in seen or (kind and key[0] != kind):
+                        continue
+                    seen.add(key)
+
+                    text_score = weight
+                    for weighted in others:
+                        best = next((w for w, p, _ in weighted if key in p), None)
+                        if best is None:
+                            break
+                        text_score += best
+                    else:
+                        entry = (text_score * boost, key, distance_km)
+                        if len(top) < limit:
+                            heapq.heappush(top, entry)
+                        elif entry[0] > top[0][0]:
+                            heapq.heapreplace(top, entry)
+
+        results = []
+        for score, key, distance_km in sorted(top, key=lambda r: r[0], reverse=True):
+            result = dict(self._docs[key])
+            result["score"] = round(score, 4)
+            if distance_km is not None:
+                result["distance_km"] = round(distance_km, 2)
+            results.append(result)
+        return results
+
+
+search_index = SearchIndex()
+
+
+async def build_search_index() -> SearchIndex:
+    """Load every chef and food item from Mongo into a fresh index."""
+    from database import db
+
+    index = SearchIndex()
+    async for chef in db["chef_user"].find(
+        {}, {"name": 1, "photo_url": 1, "food_styles": 1, "specialty": 1, "location": 1, "rating": 1}
+    ):
+        index.index_chef(chef)
+    async for item in db["food_items"].find(
+        {}, {"chef_id": 1, "food_name": 1, "food_style": 1, "food_type": 1,
+             "service_type": 1, "price": 1, "photo_url": 1}
+    ):
+        index.index_item(item)
+    return index
+
+
+async def refresh_search_index_forever():
+    """Rebuild periodically and swap the new index in.
+
+    Writes handled by this worker are applied immediately through the
+    index_* hooks. The rebuild picks up writes made by other workers.
+    """
+    while True:
+        try:
+            fresh = await build_search_index()
+            # swap contents in place so modules holding a reference see the new data
+            search_index.__dict__.update(fresh.__dict__)
+            print(f"[SEARCH] Indexed {len(search_index)} documents")
+        except Exception as e:
+            print(f"[SEARCH] Index rebuild failed: {e}")
+        await asyncio.sleep(SEARCH_REFRESH_SECONDS)
@@ -0,0 +1,73 @@
+# services/serialization.py
+import asyncio
+import functools
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+# Non-string dict keys are stringified, as json.dumps does
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Types orjson does not encode itself; datetimes, UUIDs and enums are native."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, BaseModel):
+        return obj.model_dump() if hasattr(obj, "model_dump") else obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    """Mongo documents to JSON in one pass: ObjectId as its hex string, datetimes as ISO 8601."""
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class MongoJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _render_directly(endpoint, status_code):
+    """Wrap `endpoint` so a plain return value becomes a MongoJSONResponse right away."""
+    def respond(content):
+        if isinstance(content, Response):
+            return content
+        return MongoJSONResponse(content, status_code=status_code or 200)
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            return respond(await endpoint(*args, **kwargs))
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            return respond(endpoint(*args, **kwargs))
+    wrapper.renders_directly = True
+    return wrapper
+
+
+class MongoJSONRoute(APIRoute):
+    """Route whose return value is encoded by MongoJSONResponse alone.
+
+    FastAPI would first walk every response with jsonable_encoder, which is
+    slow on large listings and rejects ObjectId. Routes with a response_model
+    or return annotation keep FastAPI's validation and encoding.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        if ((response_model is None or isinstance(response_model, DefaultPlaceholder))
+                and "return" not in getattr(endpoint, "__annotations__", {})
+                and not getattr(endpoint, "renders_directly", False)):
+            endpoint = _render_directly(endpoint, kwargs.get("status_code"))
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,149 @@
+# services/uploads.py
+import asyncio
+import hashlib
+import os
+import tempfile
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# Whole multipart body; the rider profile form carries up to three files
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 3 * MAX_UPLOAD_BYTES + 1024 * 1024))
+
+# Types are recognised from the file's first bytes, never from the client's
+# filename or Content-Type: extension -> magic-byte check
+IMAGE_TYPES = {
+    "jpg": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "png": lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+    "gif": lambda head: head[:6] in (b"GIF87a", b"GIF89a"),
+    "webp": lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP",
+}
+DOCUMENT_TYPES = {**IMAGE_TYPES, "pdf": lambda head: head.startswith(b"%PDF-")}
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_type(head: bytes, allowed: dict):
+    return next((ext for ext, matches in allowed.items() if matches(head)), None)
+
+
+def _stream_to_temp(source, folder: str, max_bytes: int, allowed: dict) -> tuple:
+    """Copy `source` into a hidden temp file in `folder`; runs in a worker thread.
+
+    Checks the type on the first chunk and the size as it goes, hashing the
+    bytes on the way through. Returns (tmp_path, ext, sha256 hex, size); the
+    caller renames the temp file into place, so readers never see a partial file.
+    """
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            first = source.read(UPLOAD_CHUNK_SIZE)
+            if not first:
+                raise UploadRejected(400, "Empty file")
+            ext = sniff_type(first, allowed)
+            if ext is None:
+                raise UploadRejected(415, f"Unsupported file type, allowed: {sorted(allowed)}")
+
+            digest = hashlib.sha256()
+            written = 0
+            chunk = first
+            while chunk:
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadRejected(413, f"File too large (limit {max_bytes // 1024} KB)")
+                digest.update(chunk)
+                out.write(chunk)
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+        return tmp_path, ext, digest.hexdigest(), written
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+
+
+def discard_temp(tmp_path: str):
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def receive_upload(upload, folder: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                         allowed: dict = IMAGE_TYPES) -> tuple:
+    """Copy an UploadFile into a temp file under `folder`: (tmp_path, ext, sha256, size).
+
+    By now Starlette has already spooled the multipart body (bounded by
+    UploadLimitMiddleware); the copy runs off the event loop in one worker
+    thread and stops at the first chunk over the per-file limit (413) or of
+    an unrecognised type (415).
+    """
+    await upload.seek(0)
+    try:
+        return await asyncio.to_thread(_stream_to_temp, upload.file, folder, max_bytes, allowed)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        await upload.close()
+
+
+class UploadLimitMiddleware:
+    """Reject multipart bodies over MAX_REQUEST_BYTES before they are buffered.
+
+    A declared Content-Length is refused up front; a chunked body is counted
+    as it is received and cut off at the limit. Either way the client gets a
+    413 instead of the body being spooled to disk first.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        too_large = JSONResponse(
+            {"detail": f"Request too large (limit {self.max_bytes // (1024 * 1024)} MB)"}, status_code=413
+        )
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > self.max_bytes:
+            return await too_large(scope, receive, send)
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    rejected = True
+                    raise UploadRejected(413, "Request too large")
+            return message
+
+        async def guarded_send(message):
+            # whatever the app makes of the aborted body is replaced by the 413
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadRejected:
+            pass
+        if rejected:
+            await too_large(scope, receive, send)